@@ -1,11 +1,38 @@
+import asyncio
+import logging
+import random
+import sqlite3
+from collections import OrderedDict
+import httpx
 import requests
-from config import THEMEALDB_BASE_URL, MAX_RECIPES_PER_SEARCH
-from video_search import VideoSearch
+from config import (
+    THEMEALDB_BASE_URL,
+    MAX_RECIPES_PER_SEARCH,
+    RANDOM_FETCH_TIMEOUT,
+    RANDOM_EXTRA_REQUESTS,
+    KNOWN_RECIPES_POOL_SIZE,
+    LISTING_REFRESH_INTERVAL,
+    LISTING_RELOAD_INTERVAL,
+    SIMILAR_RECIPES_SHOWN,
+    SIMILAR_REBUILD_INTERVAL,
+    SIMILAR_REBUILD_NEW_RECIPES
+)
+from cache import RecipeCache, ListingCache, normalize_query
+from http_client import http_client
+from recommendations import SimilarRecipes
+from models import Recipe
+from renderer import RecipeRenderer
+from singleflight import SingleFlight
+from search_index import RecipeIndex, IngredientIndex, parse_ingredients_query
+from video_search import VideoSearch, AsyncVideoSearch
+
+logger = logging.getLogger(__name__)
 
 class RecipeAPI:
     def __init__(self):
         self.base_url = THEMEALDB_BASE_URL
         self.video_search = VideoSearch()
+        self.renderer = RecipeRenderer()
     
     def search_recipes(self, query, number=MAX_RECIPES_PER_SEARCH):
         """Поиск рецептов по запросу"""
@@ -121,62 +148,481 @@ class RecipeAPI:
         except requests.RequestException as e:
             return {"error": f"Ошибка API: {str(e)}"}
     
-    def format_recipe_info(self, recipe):
+    def format_recipe_info(self, recipe, additional_videos=None):
         """Форматирование информации о рецепте для отображения"""
-        title = recipe.get('strMeal', 'Без названия')
-        image = recipe.get('strMealThumb', '')
-        category = recipe.get('strCategory', 'Не указано')
-        area = recipe.get('strArea', 'Не указано')
-        instructions = recipe.get('strInstructions', 'Инструкции не найдены')
-        
-        # Собираем ингредиенты
-        ingredients = []
-        for i in range(1, 21):  # TheMealDB может иметь до 20 ингредиентов
-            ingredient = recipe.get(f'strIngredient{i}')
-            measure = recipe.get(f'strMeasure{i}')
-            if ingredient and ingredient.strip():
-                ingredients.append(f"• {ingredient} - {measure or 'по вкусу'}")
-        
-        # Ограничиваем длину инструкций
-        if len(instructions) > 500:
-            instructions = instructions[:500] + "..."
-        
-        # Формируем текст с ингредиентами
-        ingredients_text = "\n".join(ingredients[:10])  # Показываем первые 10 ингредиентов
-        if len(ingredients) > 10:
-            ingredients_text += f"\n... и еще {len(ingredients) - 10} ингредиентов"
-        
-        # Проверяем наличие видеорецепта из TheMealDB
-        youtube_url = recipe.get('strYoutube', '')
-        video_text = ""
-        
-        if youtube_url:
-            video_text += f"\n🎥 <a href=\"{youtube_url}\">YouTube видеорецепт</a>"
+        card = self.renderer.card(recipe)
         
         # Ищем дополнительные видео на других платформах
-        additional_videos = self.video_search.search_all_videos(title)
-        if additional_videos:
-            video_text += self.video_search.format_video_links(additional_videos)
+        if additional_videos is None:
+            additional_videos = self.video_search.search_all_videos(card.title)
+        video_links = self.video_search.format_video_links(additional_videos) if additional_videos else ''
         
-        formatted_text = f"""
-🍽️ <b>{title}</b>
+        return {
+            'title': card.title,
+            'image': card.image,
+            'text': card.caption(video_links),
+            'recipe_id': card.recipe_id,
+            'source_url': card.source_url
+        }
 
-🏷️ Категория: {category}
-🌍 Кухня: {area}
 
-📋 <b>Ингредиенты:</b>
-{ingredients_text}
+class AsyncRecipeAPI(RecipeAPI):
+    """Асинхронный клиент TheMealDB поверх общего пула соединений"""
 
-📝 <b>Инструкция:</b>
-{instructions}
+    def __init__(self, client=None, cache=None, listings=None, index=None, similar=None):
+        super().__init__()
+        self.http = client or http_client
+        self.cache = cache or RecipeCache()
+        self.listings = listings or ListingCache()
+        self.index = index or RecipeIndex()
+        self.similar = similar or SimilarRecipes()
+        self.video_search = AsyncVideoSearch(self.http)
+        self.ingredient_index = IngredientIndex()
+        self._refreshing = set()
+        self.flights = SingleFlight()
+        self._background_tasks = set()
+        # Новые рецепты без рассчитанных соседей; считаются, только пока
+        # запущен start_similar_rebuild
+        self._new_recipes = 0
+        self._similar_stale = None
+        # Локальный пул уже полученных рецептов для добора случайной выдачи
+        self.known_recipes = OrderedDict()
 
-🔗 <a href="{recipe.get('strSource', '')}">Подробнее</a>{video_text}
-        """.strip()
-        
-        return {
-            'title': title,
-            'image': image,
-            'text': formatted_text,
-            'recipe_id': recipe.get('idMeal'),
-            'source_url': recipe.get('strSource', '')
-        }
+        # Индексы и пул поднимаем из кэша (в том числе из зеркала каталога)
+        if len(self.index) == 0:
+            self.index.rebuild(self.cache.all_recipes())
+        self.ingredient_index.rebuild(self.cache.all_recipes())
+        for recipe in self.cache.all_recipes():
+            if len(self.known_recipes) >= KNOWN_RECIPES_POOL_SIZE:
+                break
+            self.known_recipes[recipe['idMeal']] = recipe
+
+    def _remember(self, recipe):
+        """Запоминание полного рецепта, полученного от API.
+
+        Возвращает компактный Recipe, который и следует отдавать дальше,
+        чтобы словарь API не задерживался в памяти.
+        """
+        if not recipe.get('idMeal') or not recipe.get('strInstructions'):
+            return recipe
+        recipe = Recipe.from_api(recipe)
+        recipe_id = recipe.id
+        self.known_recipes[recipe_id] = recipe
+        self.known_recipes.move_to_end(recipe_id)
+        while len(self.known_recipes) > KNOWN_RECIPES_POOL_SIZE:
+            self.known_recipes.popitem(last=False)
+        self.renderer.forget(recipe_id)
+        self.cache.put(recipe)
+        self.index.add(recipe)
+        self.ingredient_index.add(recipe)
+        if self._similar_stale is not None and not self.similar.get(recipe_id, 1):
+            self._new_recipes += 1
+            if self._new_recipes >= SIMILAR_REBUILD_NEW_RECIPES:
+                self._similar_stale.set()
+        return recipe
+
+    def _run_in_background(self, coro):
+        """Запуск фоновой задачи с сохранением ссылки на нее"""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    async def _get_json(self, path, params=None):
+        """GET запрос к TheMealDB, возвращает разобранный JSON.
+
+        Ответ, который не является JSON-объектом (например, HTML страница
+        ошибки), считается ошибкой HTTP, как и неуспешный статус.
+        """
+        response = await self.http.get(f"{self.base_url}/{path}", params=params)
+        response.raise_for_status()
+        try:
+            data = response.json()
+        except ValueError as e:
+            raise httpx.DecodingError(f"Некорректный JSON в ответе {path}: {e}", request=response.request)
+        if not isinstance(data, dict):
+            raise httpx.DecodingError(f"Неожиданный формат ответа {path}", request=response.request)
+        return data
+
+    def search_local_recipes(self, query, number=MAX_RECIPES_PER_SEARCH, require_all=False):
+        """Поиск по локальному индексу уже известных рецептов.
+
+        require_all=True - только рецепты, в которых нашлись все слова запроса.
+        """
+        recipes = []
+        for recipe_id in self.index.search(query, number, require_all):
+            recipe, _ = self.cache.get(recipe_id)
+            if recipe is not None:
+                recipes.append(recipe)
+        return recipes
+
+    async def search_recipes(self, query, number=MAX_RECIPES_PER_SEARCH):
+        """Поиск рецептов по запросу: локальный индекс, затем TheMealDB.
+
+        Одновременные одинаковые запросы выполняются один раз.
+        """
+        key = ('search', normalize_query(query), number)
+        return await self.flights.do(key, self._search_recipes, query, number)
+
+    async def _search_recipes(self, query, number):
+        # Без API отвечаем, только если локально нашлись рецепты со всеми словами
+        # запроса: совпадения по одному слову ("beef" из "beef wellington")
+        # не заменяют поиск TheMealDB, а лишь дополняют его
+        local = self.search_local_recipes(query, number, require_all=True)
+        if len(local) >= number:
+            return {'meals': local}
+        if not local:
+            local = self.search_local_recipes(query, number)
+
+        try:
+            data = await self._get_json('search.php', {'s': query})
+        except httpx.HTTPError as e:
+            # Без доступа к API отвечаем тем, что есть локально
+            if local:
+                return {'meals': local}
+            return {"error": f"Ошибка API: {str(e)}"}
+
+        meals = [self._remember(recipe) for recipe in (data.get('meals') or [])[:number]]
+
+        # Дополняем выдачу API локальными совпадениями
+        seen = {recipe['idMeal'] for recipe in meals}
+        for recipe in local:
+            if len(meals) >= number:
+                break
+            if recipe['idMeal'] not in seen:
+                meals.append(recipe)
+        return {'meals': meals}
+
+    async def search_by_ingredients(self, text, number=MAX_RECIPES_PER_SEARCH):
+        """Поиск рецептов по ингредиентам ("chicken, rice, garlic").
+
+        Возвращает список записей с полем idMeal, детали загружаются через
+        get_recipe_details (для локальных совпадений - из кэша). Если локальный
+        индекс ничего не нашел, используется filter.php по первому ингредиенту.
+        """
+        ingredients = parse_ingredients_query(text)
+        if not ingredients:
+            return []
+
+        recipe_ids = self.ingredient_index.search(ingredients, number)
+        if recipe_ids:
+            return [{'idMeal': recipe_id} for recipe_id in recipe_ids]
+
+        # Бесплатный API TheMealDB фильтрует только по одному ингредиенту
+        try:
+            data = await self._get_json('filter.php', {'i': ingredients[0].replace(' ', '_')})
+        except httpx.HTTPError as e:
+            return {"error": f"Ошибка API: {str(e)}"}
+        return (data.get('meals') or [])[:number]
+
+    async def get_similar_recipes(self, recipe_id, number=SIMILAR_RECIPES_SHOWN):
+        """Похожие рецепты (записи с полем idMeal).
+
+        Берутся из предрасчитанных соседей, а для рецептов, которых еще нет
+        в расчете, - из той же категории.
+        """
+        recipe_ids = self.similar.get(recipe_id, number)
+        if recipe_ids:
+            return [{'idMeal': similar_id} for similar_id in recipe_ids]
+
+        recipe = await self.get_recipe_details(recipe_id)
+        if "error" in recipe:
+            return recipe
+        if not recipe.get('strCategory'):
+            return []
+
+        listing = await self.get_recipes_by_category(recipe['strCategory'])
+        if "error" in listing:
+            return listing
+        return [
+            item for item in listing
+            if str(item['idMeal']) != str(recipe_id)
+        ][:number]
+
+    def rebuild_similar_recipes(self):
+        """Пересчет похожих рецептов по всем рецептам из кэша.
+
+        Читает кэш через отдельное соединение, поэтому может выполняться
+        в пуле потоков.
+        """
+        conn = sqlite3.connect(self.cache.db_name)
+        try:
+            return self.similar.rebuild(self.cache.all_recipes(conn))
+        finally:
+            conn.close()
+
+    async def get_recipe_details(self, recipe_id):
+        """Получение детальной информации о рецепте (сначала из кэша)"""
+        recipe, is_fresh = self.cache.get(recipe_id)
+        if recipe is not None:
+            if not is_fresh:
+                self._refresh_recipe_details(recipe_id)
+            return recipe
+        return await self.fetch_recipe_details(recipe_id)
+
+    def _refresh_recipe_details(self, recipe_id):
+        """Фоновое обновление устаревшего рецепта (stale-while-revalidate)"""
+        key = str(recipe_id)
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+
+        async def refresh():
+            try:
+                await self.fetch_recipe_details(recipe_id)
+            finally:
+                self._refreshing.discard(key)
+
+        self._run_in_background(refresh())
+
+    async def fetch_recipe_details(self, recipe_id):
+        """Запрос lookup.php в обход кэша с сохранением результата.
+
+        Одновременные запросы одного рецепта (промахи кэша, фоновое
+        обновление, синхронизация каталога) уходят в API один раз.
+        """
+        key = ('details', str(recipe_id))
+        return await self.flights.do(key, self._fetch_recipe_details, recipe_id)
+
+    async def _fetch_recipe_details(self, recipe_id):
+        try:
+            data = await self._get_json('lookup.php', {'i': recipe_id})
+            if data.get('meals'):
+                return self._remember(data['meals'][0])
+            return {"error": "Рецепт не найден"}
+        except httpx.HTTPError as e:
+            return {"error": f"Ошибка API: {str(e)}"}
+
+    async def _fetch_random_recipe(self):
+        """Один запрос random.php"""
+        data = await self._get_json('random.php')
+        meals = data.get('meals') or []
+        return meals[0] if meals else None
+
+    async def get_random_recipes(self, number=5):
+        """Получение случайных рецептов одним параллельным пакетом"""
+        number = min(number, 10)
+        # TheMealDB отдает один рецепт за запрос и может повторяться,
+        # поэтому запрашиваем с небольшим запасом
+        tasks = [
+            asyncio.create_task(self._fetch_random_recipe())
+            for _ in range(number + RANDOM_EXTRA_REQUESTS)
+        ]
+        done, pending = await asyncio.wait(tasks, timeout=RANDOM_FETCH_TIMEOUT)
+        for task in pending:
+            task.cancel()
+
+        recipes = {}
+        last_error = None
+        for task in done:
+            if task.exception() is not None:
+                last_error = task.exception()
+                continue
+            recipe = task.result()
+            if recipe and len(recipes) < number:
+                recipe = self._remember(recipe)
+                recipes.setdefault(recipe['idMeal'], recipe)
+
+        # Если API медленный или вернул повторы, добираем из локального пула
+        if len(recipes) < number:
+            candidates = [
+                recipe_id for recipe_id in self.known_recipes
+                if recipe_id not in recipes
+            ]
+            for recipe_id in random.sample(candidates, min(number - len(recipes), len(candidates))):
+                recipes[recipe_id] = self.known_recipes[recipe_id]
+
+        if not recipes and last_error is not None:
+            return {"error": f"Ошибка API: {str(last_error)}"}
+        return {'meals': list(recipes.values())}
+
+    async def _fetch_categories(self):
+        """Запрос списка категорий"""
+        data = await self._get_json('categories.php')
+        return data.get('categories') or []
+
+    async def _fetch_areas(self):
+        """Запрос списка кухонь мира"""
+        data = await self._get_json('list.php', {'a': 'list'})
+        return data.get('meals') or []
+
+    async def _fetch_listing(self, key):
+        """Запрос списка по ключу кэша: categories, areas, category:<имя>, area:<имя>"""
+        if key == 'categories':
+            listing, field = await self._fetch_categories(), 'strCategory'
+        elif key == 'areas':
+            listing, field = await self._fetch_areas(), 'strArea'
+        else:
+            kind, name = key.split(':', 1)
+            param = 'c' if kind == 'category' else 'a'
+            data = await self._get_json('filter.php', {param: name})
+            listing, field = data.get('meals') or [], 'idMeal'
+
+        # Список с записями без ключевого поля не кэшируем, чтобы не затереть им рабочий
+        if not isinstance(listing, list) or not all(isinstance(item, dict) and field in item for item in listing):
+            raise httpx.DecodingError(f"Неожиданный формат списка {key}")
+        return listing
+
+    async def _get_listing(self, key):
+        """Получение списка из кэша, при промахе - из API"""
+        listing = self.listings.get(key)
+        if listing is not None:
+            return listing
+
+        try:
+            listing = await self._fetch_listing(key)
+        except httpx.HTTPError as e:
+            return {"error": f"Ошибка API: {str(e)}"}
+
+        if listing or ':' not in key:
+            self.listings.put(key, listing)
+        return listing
+
+    async def _is_known(self, kind, name):
+        """Есть ли категория (kind='category') или кухня (kind='area') в списках TheMealDB"""
+        if kind == 'category':
+            listing, field = await self.get_categories(), 'strCategory'
+        else:
+            listing, field = await self.get_areas(), 'strArea'
+        if "error" in listing:
+            return False
+        return any(item.get(field) == name for item in listing)
+
+    async def get_categories(self):
+        """Получение списка категорий"""
+        return await self._get_listing('categories')
+
+    async def get_areas(self):
+        """Получение списка кухонь мира"""
+        return await self._get_listing('areas')
+
+    async def get_recipes_by_category(self, category):
+        """Получение рецептов по категории (только из списка категорий TheMealDB)"""
+        if not await self._is_known('category', category):
+            return []
+        return await self._get_listing(f'category:{category}')
+
+    async def get_recipes_by_area(self, area):
+        """Получение рецептов по кухне (только из списка кухонь TheMealDB)"""
+        if not await self._is_known('area', area):
+            return []
+        return await self._get_listing(f'area:{area}')
+
+    def _store_refreshed_listing(self, key, listing):
+        """Сохранение обновленного списка; пустой ответ не затирает непустой список"""
+        if not listing and self.listings.get(key):
+            logger.warning(f"Список {key} пришел пустым, оставляю сохраненный")
+            return False
+        if not listing and ':' in key:
+            # Пустые списки рецептов не храним, чтобы не копить ключи без данных
+            return False
+        self.listings.put(key, listing)
+        return True
+
+    async def _refresh_listing(self, key, limiter=None):
+        """Обновление одного списка, ошибки только логируются"""
+        try:
+            if limiter is not None:
+                await limiter.acquire()
+            listing = await self._fetch_listing(key)
+        except httpx.HTTPError as e:
+            logger.warning(f"Не удалось обновить список {key}: {e}")
+            return False
+        except Exception:
+            logger.exception(f"Ошибка разбора списка {key}")
+            return False
+        return self._store_refreshed_listing(key, listing)
+
+    async def refresh_listings(self, limiter=None):
+        """Обновление категорий, кухонь и всех списков рецептов по ним.
+
+        limiter (RateLimiter) ограничивает частоту запросов, например при
+        синхронизации каталога.
+        """
+        for key in ('categories', 'areas'):
+            await self._refresh_listing(key, limiter)
+
+        # Списки рецептов прогреваем и обновляем только для известных категорий
+        # и кухонь: ключи с другими именами могли прийти из подделанных callback data
+        keys = set()
+        for category in self.listings.get('categories') or []:
+            keys.add(f"category:{category['strCategory']}")
+        for area in self.listings.get('areas') or []:
+            keys.add(f"area:{area['strArea']}")
+
+        await asyncio.gather(*(self._refresh_listing(key, limiter) for key in keys))
+
+    def start_listing_refresh(self, interval=LISTING_REFRESH_INTERVAL):
+        """Прогрев кэша списков и периодическое фоновое обновление"""
+
+        async def refresh_forever():
+            while True:
+                try:
+                    await self.refresh_listings()
+                except Exception:
+                    # Фоновая задача не должна умирать из-за одного неудачного обновления
+                    logger.exception("Ошибка обновления списков")
+                await asyncio.sleep(interval)
+
+        return self._run_in_background(refresh_forever())
+
+    def start_similar_rebuild(self, interval=SIMILAR_REBUILD_INTERVAL):
+        """Фоновый пересчет похожих рецептов в пуле потоков.
+
+        Сразу, если соседи еще не рассчитаны, затем раз в interval секунд при
+        появлении новых рецептов или раньше, когда их накопится
+        SIMILAR_REBUILD_NEW_RECIPES.
+        """
+        self._similar_stale = asyncio.Event()
+
+        async def rebuild_forever():
+            loop = asyncio.get_running_loop()
+            rebuild = not len(self.similar)
+            while True:
+                if rebuild:
+                    self._new_recipes = 0
+                    self._similar_stale.clear()
+                    try:
+                        count = await loop.run_in_executor(None, self.rebuild_similar_recipes)
+                        logger.info(f"Похожие рецепты рассчитаны для {count} рецептов")
+                    except Exception:
+                        logger.exception("Ошибка расчета похожих рецептов")
+                try:
+                    await asyncio.wait_for(self._similar_stale.wait(), interval)
+                except asyncio.TimeoutError:
+                    pass
+                rebuild = self._new_recipes > 0
+
+        return self._run_in_background(rebuild_forever())
+
+    def start_listing_reload(self, interval=LISTING_RELOAD_INTERVAL):
+        """Периодическое перечитывание списков, которые обновляет другой процесс"""
+
+        async def reload_forever():
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    self.listings.reload()
+                except Exception:
+                    logger.exception("Ошибка чтения списков из кэша")
+
+        return self._run_in_background(reload_forever())
+
+    def format_recipe_info(self, recipe, additional_videos=()):
+        """Форматирование рецепта без поиска видео.
+
+        Видео ищутся асинхронно через video_search и передаются сюда
+        повторно, когда найдены.
+        """
+        return super().format_recipe_info(recipe, list(additional_videos))
+
+    async def close(self):
+        """Закрытие пула соединений и кэша"""
+        for task in list(self._background_tasks):
+            task.cancel()
+        await self.http.close()
+        self.cache.close()
+        self.listings.close()
+        self.index.close()
+        self.similar.close()
+        self.video_search.close()
@@ -1,10 +1,18 @@
+import asyncio
+import html
 import logging
-from telegram import Update
+from telegram import Update, InputMediaPhoto, Message
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
 from telegram.constants import ParseMode
-from config import TELEGRAM_TOKEN
-from database import Database
-from api_client import RecipeAPI
+from telegram.error import BadRequest, TelegramError
+from config import (
+    TELEGRAM_TOKEN, MAX_RECIPES_PER_SEARCH, DETAILS_FETCH_CONCURRENCY,
+    MAX_FAVORITES_PER_USER, FAVORITES_PAGE_SIZE, SEND_GLOBAL_RATE, RESULTS_MODE
+)
+from database import AsyncDatabase
+from api_client import AsyncRecipeAPI
+from state_store import create_state_store, StateStorePersistence
+from sender import MessageScheduler, BULK_PRIORITY
 from keyboards import (
     get_main_menu_keyboard, 
     get_recipe_actions_keyboard, 
@@ -26,11 +34,11 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Инициализация компонентов
-db = Database()
-api = RecipeAPI()
+db = AsyncDatabase()
+api = AsyncRecipeAPI()
 
-# Словарь для хранения состояний пользователей
-user_states = {}
+# Состояния пользователей (с TTL и ограничением размера, см. STATE_BACKEND)
+user_states = create_state_store()
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
@@ -38,7 +46,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = user.id
     
     # Добавляем пользователя в базу данных
-    db.add_user(user_id, user.username, user.first_name, user.last_name)
+    await db.add_user(user_id, user.username, user.first_name, user.last_name)
     
     welcome_message = f"""
 👋 Привет, {user.first_name}!
@@ -67,8 +75,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await show_search_options(update, context)
     elif text == "❤️ Мои рецепты":
         await show_favorites(update, context)
-    elif user_id in user_states and user_states[user_id] == "waiting_for_search":
+    elif user_states.get(user_id) == "waiting_for_search":
         await search_recipes(update, context, text)
+    elif user_states.get(user_id) == "waiting_for_ingredients":
+        await search_by_ingredients(update, context, text)
     else:
         await update.message.reply_text(
             "Пожалуйста, используйте кнопки меню для навигации.",
@@ -78,7 +88,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def show_search_options(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать опции поиска"""
     user_id = update.effective_user.id
-    user_states[user_id] = "search_options"
+    user_states.set(user_id, "search_options")
     
     message = """
 🔍 <b>Поиск рецептов</b>
@@ -111,7 +121,7 @@ async def search_recipes(update: Update, context: ContextTypes.DEFAULT_TYPE, que
     await update.message.reply_text("🔍 Ищу рецепты...")
     
     # Поиск рецептов через API
-    result = api.search_recipes(query)
+    result = await api.search_recipes(query)
     
     if "error" in result:
         await update.message.reply_text(f"❌ Ошибка: {result['error']}")
@@ -127,41 +137,23 @@ async def search_recipes(update: Update, context: ContextTypes.DEFAULT_TYPE, que
         return
     
     # Показываем найденные рецепты
-    for recipe in recipes:
-        formatted_recipe = api.format_recipe_info(recipe)
-        is_favorite = db.is_favorite_recipe(user_id, formatted_recipe['recipe_id'])
-        rating = db.get_recipe_rating(user_id, formatted_recipe['recipe_id']) if is_favorite else 0
-        
-        if formatted_recipe['image']:
-            await update.message.reply_photo(
-                photo=formatted_recipe['image'],
-                caption=formatted_recipe['text'],
-                parse_mode=ParseMode.HTML,
-                reply_markup=get_recipe_actions_keyboard(
-                    formatted_recipe['recipe_id'], 
-                    is_favorite,
-                    rating
-                )
-            )
-        else:
-            await update.message.reply_text(
-                formatted_recipe['text'],
-                parse_mode=ParseMode.HTML,
-                reply_markup=get_recipe_actions_keyboard(
-                    formatted_recipe['recipe_id'], 
-                    is_favorite,
-                    rating
-                )
-            )
+    await send_results(update, context, recipes)
     
-    user_states[user_id] = "search_results"
+    user_states.set(user_id, "search_results")
 
-async def show_favorites(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показать избранные рецепты"""
+async def show_favorites(update: Update, context: ContextTypes.DEFAULT_TYPE, cursor=None, direction='next', page=1):
+    """Показать избранные рецепты (постранично)"""
     user_id = update.effective_user.id
-    user_states[user_id] = "favorites"
+    user_states.set(user_id, "favorites")
     
-    favorites = db.get_favorite_recipes(user_id)
+    result = await db.get_favorite_recipes_page(user_id, cursor, direction)
+    favorites = result['recipes']
+    
+    if not favorites and cursor is not None:
+        # Страница опустела (рецепты удалили) - начинаем сначала
+        result = await db.get_favorite_recipes_page(user_id)
+        favorites = result['recipes']
+        page = 1
     
     if not favorites:
         message = "❤️ У вас пока нет избранных рецептов.\n\nНайдите интересные рецепты и добавьте их в избранное!"
@@ -177,32 +169,56 @@ async def show_favorites(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
         return
     
-    message = f"❤️ <b>Ваши избранные рецепты</b> ({len(favorites)} шт.)\n\n"
+    total = await db.count_favorite_recipes(user_id)
+    message = f"❤️ <b>Ваши избранные рецепты</b> ({total} шт.)\n\n"
     
-    for i, recipe in enumerate(favorites, 1):
+    first_number = (page - 1) * FAVORITES_PAGE_SIZE + 1
+    for i, recipe in enumerate(favorites, first_number):
         rating = recipe.get('rating', 0)
         rating_stars = "⭐" * rating + "☆" * (5 - rating)
         message += f"{i}. {recipe['title']} {rating_stars}\n"
     
+    first, last = favorites[0], favorites[-1]
+    reply_markup = get_favorites_menu_keyboard(
+        prev_cursor=(first['rating'], first['added_at'], first['id']) if result['has_prev'] else None,
+        next_cursor=(last['rating'], last['added_at'], last['id']) if result['has_next'] else None,
+        page=page
+    )
+    
     if update.callback_query:
         await update.callback_query.edit_message_text(
             message,
             parse_mode=ParseMode.HTML,
-            reply_markup=get_favorites_menu_keyboard()
+            reply_markup=reply_markup
         )
     else:
         await update.message.reply_text(
             message,
             parse_mode=ParseMode.HTML,
-            reply_markup=get_favorites_menu_keyboard()
+            reply_markup=reply_markup
         )
 
+# Префиксы callback data, обработчики которых сами вызывают query.answer()
+SELF_ANSWERING_CALLBACKS = ("add_favorite_", "remove_favorite_", "rate_", "similar_", "car_")
+
+def parse_favorites_cursor(data):
+    """Разбор callback data вида fav_<direction>_<page>_<rating>_<timestamp>_<id>"""
+    _, direction, page, rating, timestamp, favorite_id = data.split("_")
+    added_at = (
+        f"{timestamp[0:4]}-{timestamp[4:6]}-{timestamp[6:8]} "
+        f"{timestamp[8:10]}:{timestamp[10:12]}:{timestamp[12:14]}"
+    )
+    return direction, int(page), (int(rating), added_at, int(favorite_id))
+
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик callback запросов"""
     query = update.callback_query
-    await query.answer()
-    
     data = query.data
+    # Действия с избранным, оценки, похожие рецепты и карусель отвечают на callback
+    # сами, с текстом уведомления: Telegram принимает только один ответ на каждый callback
+    if not data.startswith(SELF_ANSWERING_CALLBACKS):
+        await query.answer()
+    
     user_id = update.effective_user.id
     
     if data.startswith("add_favorite_"):
@@ -228,6 +244,9 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif data == "search_by_area":
         await show_areas(update, context)
     
+    elif data == "search_by_ingredients":
+        await ask_ingredients(update, context)
+    
     elif data.startswith("category_"):
         category = data.split("_", 1)[1]
         await search_by_category(update, context, category)
@@ -236,6 +255,14 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         area = data.split("_", 1)[1]
         await search_by_area(update, context, area)
     
+    elif data.startswith("car_"):
+        index, recipe_ids = parse_carousel_data(data)
+        await show_carousel_recipe(update, context, index, recipe_ids)
+    
+    elif data.startswith("similar_"):
+        recipe_id = int(data.split("_")[1])
+        await show_similar_recipes(update, context, recipe_id)
+    
     elif data.startswith("more_videos_"):
         recipe_id = int(data.split("_")[2])
         await show_more_videos(update, context, recipe_id)
@@ -248,20 +275,33 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     elif data == "back_to_favorites":
         await show_favorites(update, context)
+    
+    elif data.startswith("fav_"):
+        direction, page, cursor = parse_favorites_cursor(data)
+        await show_favorites(update, context, cursor, direction, page)
 
 async def add_to_favorites(update: Update, context: ContextTypes.DEFAULT_TYPE, recipe_id):
     """Добавить рецепт в избранное"""
     user_id = update.effective_user.id
     
+    if (await db.count_favorite_recipes(user_id) >= MAX_FAVORITES_PER_USER
+            and not await db.is_favorite_recipe(user_id, recipe_id)):
+        await update.callback_query.answer(
+            f"⚠️ В избранном уже {MAX_FAVORITES_PER_USER} рецептов. Удалите что-нибудь, чтобы добавить новый.",
+            show_alert=True
+        )
+        return
+    
     # Получаем информацию о рецепте
-    recipe_info = api.get_recipe_details(recipe_id)
+    recipe_info = await api.get_recipe_details(recipe_id)
     
     if "error" in recipe_info:
+        await update.callback_query.answer()
         await update.callback_query.edit_message_text(f"❌ Ошибка: {recipe_info['error']}")
         return
     
     # Добавляем в базу данных
-    success = db.add_favorite_recipe(
+    success = await db.add_favorite_recipe(
         user_id,
         recipe_id,
         recipe_info.get('strMeal', ''),
@@ -273,28 +313,28 @@ async def add_to_favorites(update: Update, context: ContextTypes.DEFAULT_TYPE, r
         await update.callback_query.answer("✅ Рецепт добавлен в избранное!")
         # Обновляем клавиатуру с рейтингом 0
         await update.callback_query.edit_message_reply_markup(
-            get_recipe_actions_keyboard(recipe_id, True, 0)
+            get_recipe_actions_keyboard(recipe_id, True, 0, current_carousel(update))
         )
     else:
         # Если рецепт уже в избранном, получаем его текущий рейтинг
-        current_rating = db.get_recipe_rating(user_id, recipe_id)
+        current_rating = await db.get_recipe_rating(user_id, recipe_id)
         await update.callback_query.answer("⚠️ Рецепт уже в избранном!")
         # Обновляем клавиатуру с текущим рейтингом
         await update.callback_query.edit_message_reply_markup(
-            get_recipe_actions_keyboard(recipe_id, True, current_rating)
+            get_recipe_actions_keyboard(recipe_id, True, current_rating, current_carousel(update))
         )
 
 async def remove_from_favorites(update: Update, context: ContextTypes.DEFAULT_TYPE, recipe_id):
     """Удалить рецепт из избранного"""
     user_id = update.effective_user.id
     
-    success = db.remove_favorite_recipe(user_id, recipe_id)
+    success = await db.remove_favorite_recipe(user_id, recipe_id)
     
     if success:
         await update.callback_query.answer("✅ Рецепт удален из избранного!")
         # Обновляем клавиатуру без рейтинга
         await update.callback_query.edit_message_reply_markup(
-            get_recipe_actions_keyboard(recipe_id, False, 0)
+            get_recipe_actions_keyboard(recipe_id, False, 0, current_carousel(update))
         )
     else:
         await update.callback_query.answer("❌ Рецепт не найден в избранном!")
@@ -305,18 +345,18 @@ async def rate_recipe(update: Update, context: ContextTypes.DEFAULT_TYPE, recipe
     
     try:
         # Проверяем, что рецепт в избранном
-        if not db.is_favorite_recipe(user_id, recipe_id):
+        if not await db.is_favorite_recipe(user_id, recipe_id):
             await update.callback_query.answer("❌ Сначала добавьте рецепт в избранное!")
             return
         
         # Обновляем рейтинг
-        success = db.update_recipe_rating(user_id, recipe_id, rating)
+        success = await db.update_recipe_rating(user_id, recipe_id, rating)
         
         if success:
             await update.callback_query.answer(f"✅ Оценка {rating}⭐ установлена!")
             # Обновляем клавиатуру с новым рейтингом
             await update.callback_query.edit_message_reply_markup(
-                get_recipe_actions_keyboard(recipe_id, True, rating)
+                get_recipe_actions_keyboard(recipe_id, True, rating, current_carousel(update))
             )
         else:
             await update.callback_query.answer("❌ Ошибка при установке рейтинга!")
@@ -329,7 +369,7 @@ async def show_more_videos(update: Update, context: ContextTypes.DEFAULT_TYPE, r
     user_id = update.effective_user.id
     
     # Получаем информацию о рецепте
-    recipe_info = api.get_recipe_details(recipe_id)
+    recipe_info = await api.get_recipe_details(recipe_id)
     
     if "error" in recipe_info:
         await update.callback_query.answer("❌ Ошибка при получении рецепта!")
@@ -347,7 +387,7 @@ async def show_more_videos(update: Update, context: ContextTypes.DEFAULT_TYPE, r
         await update.callback_query.answer("🎥 Ищу дополнительные видео...")
     
     # Ищем видео на всех платформах
-    videos = api.video_search.search_all_videos(recipe_title)
+    videos = await api.video_search.search_all_videos(recipe_title)
     
     if not videos:
         message = f"😔 Дополнительные видео для '{recipe_title}' не найдены."
@@ -373,7 +413,7 @@ async def show_more_videos(update: Update, context: ContextTypes.DEFAULT_TYPE, r
             'YouTube': '🔴'
         }.get(video['platform'], '📹')
         
-        message += f"{i}. {platform_icon} <a href=\"{video['url']}\">{video['platform']} - {video['title']}</a>\n"
+        message += f"{i}. {platform_icon} <a href=\"{video['url']}\">{video['platform']} - {html.escape(video['title'])}</a>\n"
     
     message += f"\n🔙 <a href=\"#\">Назад к рецепту</a>"
     
@@ -390,14 +430,35 @@ async def show_more_videos(update: Update, context: ContextTypes.DEFAULT_TYPE, r
             reply_markup=get_recipe_actions_keyboard(recipe_id, False, 0)
         )
 
+async def show_similar_recipes(update: Update, context: ContextTypes.DEFAULT_TYPE, recipe_id):
+    """Показать похожие рецепты"""
+    user_id = update.effective_user.id
+    user_states.set(user_id, "search_results")
+    
+    recipes = await api.get_similar_recipes(recipe_id)
+    
+    if "error" in recipes:
+        await update.callback_query.answer("❌ Ошибка при поиске похожих рецептов!")
+        return
+    
+    if not recipes:
+        await update.callback_query.answer("😔 Похожие рецепты не найдены.")
+        return
+    
+    await update.callback_query.answer()
+    sent = await send_recipe_details_as_ready(update, context, recipes)
+    
+    if not sent:
+        await update.callback_query.message.reply_text("😔 Не удалось загрузить рецепты.")
+
 async def get_random_recipes(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получить случайные рецепты"""
     user_id = update.effective_user.id
-    user_states[user_id] = "search_results"
+    user_states.set(user_id, "search_results")
     
     await update.callback_query.edit_message_text("🎲 Ищу случайные рецепты...")
     
-    result = api.get_random_recipes(3)
+    result = await api.get_random_recipes(3)
     
     if "error" in result:
         await update.callback_query.edit_message_text(f"❌ Ошибка: {result['error']}")
@@ -409,40 +470,13 @@ async def get_random_recipes(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.callback_query.edit_message_text("😔 Не удалось найти рецепты.")
         return
     
-    for recipe in recipes:
-        formatted_recipe = api.format_recipe_info(recipe)
-        is_favorite = db.is_favorite_recipe(user_id, formatted_recipe['recipe_id'])
-        rating = db.get_recipe_rating(user_id, formatted_recipe['recipe_id']) if is_favorite else 0
-        
-        if formatted_recipe['image']:
-            await context.bot.send_photo(
-                chat_id=update.effective_chat.id,
-                photo=formatted_recipe['image'],
-                caption=formatted_recipe['text'],
-                parse_mode=ParseMode.HTML,
-                reply_markup=get_recipe_actions_keyboard(
-                    formatted_recipe['recipe_id'], 
-                    is_favorite,
-                    rating
-                )
-            )
-        else:
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=formatted_recipe['text'],
-                parse_mode=ParseMode.HTML,
-                reply_markup=get_recipe_actions_keyboard(
-                    formatted_recipe['recipe_id'], 
-                    is_favorite,
-                    rating
-                )
-            )
+    await send_results(update, context, recipes)
 
 async def show_categories(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать категории рецептов"""
     await update.callback_query.edit_message_text("🏷️ Загружаю категории...")
     
-    categories = api.get_categories()
+    categories = await api.get_categories()
     
     if "error" in categories:
         await update.callback_query.edit_message_text(f"❌ Ошибка: {categories['error']}")
@@ -463,7 +497,7 @@ async def show_areas(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать кухни мира"""
     await update.callback_query.edit_message_text("🌍 Загружаю кухни мира...")
     
-    areas = api.get_areas()
+    areas = await api.get_areas()
     
     if "error" in areas:
         await update.callback_query.edit_message_text(f"❌ Ошибка: {areas['error']}")
@@ -480,72 +514,326 @@ async def show_areas(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=get_areas_keyboard(areas)
     )
 
-async def search_by_category(update: Update, context: ContextTypes.DEFAULT_TYPE, category):
-    """Поиск рецептов по категории"""
+async def get_recipe_keyboard(user_id, recipe_id, favorites=None, carousel=None):
+    """Клавиатура действий с учетом избранного и рейтинга пользователя"""
+    if favorites is None:
+        favorites = await db.get_favorites_status(user_id, [recipe_id])
+    rating = favorites.get(recipe_id)
+    return get_recipe_actions_keyboard(recipe_id, rating is not None, rating or 0, carousel)
+
+def parse_carousel_data(data):
+    """Разбор callback data вида car_<позиция>_<id>-<id>-..."""
+    _, index, recipe_ids = data.split("_", 2)
+    return int(index), tuple(recipe_ids.split("-"))
+
+def current_carousel(update: Update):
+    """Позиция карусели из клавиатуры сообщения, если это карусель"""
+    reply_markup = update.callback_query.message.reply_markup
+    if not reply_markup:
+        return None
+    for row in reply_markup.inline_keyboard:
+        for button in row:
+            # Кнопка с номером страницы хранит текущую позицию
+            if (button.callback_data or "").startswith("car_") and "/" in button.text:
+                return parse_carousel_data(button.callback_data)
+    return None
+
+async def send_results(update: Update, context: ContextTypes.DEFAULT_TYPE, recipes):
+    """Отправка выдачи рецептов в режиме RESULTS_MODE.
+    
+    cards - отдельная карточка на каждый рецепт, album - один альбом,
+    carousel - одно сообщение с перелистыванием.
+    """
     user_id = update.effective_user.id
-    user_states[user_id] = "search_results"
+    chat_id = update.effective_chat.id
     
-    await update.callback_query.edit_message_text(f"🏷️ Ищу рецепты в категории '{category}'...")
+    if RESULTS_MODE == 'album' and await send_recipe_album(context, chat_id, recipes):
+        return
     
-    recipes = api.get_recipes_by_category(category)
+    favorites = await db.get_favorites_status(user_id, [recipe['idMeal'] for recipe in recipes])
     
-    if "error" in recipes:
-        await update.callback_query.edit_message_text(f"❌ Ошибка: {recipes['error']}")
+    if RESULTS_MODE == 'carousel' and len(recipes) > 1:
+        # Все id выдачи хранятся в callback data (до 64 байт) - не больше 8 рецептов
+        carousel = (0, tuple(recipe['idMeal'] for recipe in recipes[:8]))
+        await send_recipe_card(context, chat_id, user_id, recipes[0], favorites, carousel)
         return
     
-    if not recipes:
-        await update.callback_query.edit_message_text("😔 Рецепты не найдены в этой категории.")
+    for recipe in recipes:
+        await send_recipe_card(context, chat_id, user_id, recipe, favorites)
+
+# Фрагменты ошибок Telegram о недействительном file_id
+BAD_FILE_ID_ERRORS = ("wrong file identifier", "wrong remote file")
+
+def is_bad_file_id(error):
+    """Telegram отклонил запрос из-за file_id, а не из-за подписи или разметки"""
+    message = str(error).lower()
+    return any(marker in message for marker in BAD_FILE_ID_ERRORS)
+
+async def send_recipe_album(context: ContextTypes.DEFAULT_TYPE, chat_id, recipes):
+    """Отправка выдачи одним альбомом (без кнопок и поиска видео).
+    
+    Возвращает False, если альбом собрать нельзя (меньше двух фотографий).
+    """
+    recipes = [recipe for recipe in recipes if recipe.get('strMealThumb')][:10]
+    if len(recipes) < 2:
+        return False
+    
+    formatted_recipes = [api.format_recipe_info(recipe) for recipe in recipes]
+    file_ids = [await db.get_photo_file_id(formatted_recipe['image']) for formatted_recipe in formatted_recipes]
+    
+    def album(use_file_ids):
+        return [
+            InputMediaPhoto(
+                media=(file_id if use_file_ids else None) or formatted_recipe['image'],
+                caption=formatted_recipe['text'],
+                parse_mode=ParseMode.HTML
+            )
+            for formatted_recipe, file_id in zip(formatted_recipes, file_ids)
+        ]
+    
+    try:
+        messages = await context.bot.send_media_group(chat_id=chat_id, media=album(True), rate_limit_args=BULK_PRIORITY)
+    except BadRequest as e:
+        if not any(file_ids) or not is_bad_file_id(e):
+            raise
+        # Telegram не сообщает, какой из file_id недействителен: забываем все
+        # использованные и отправляем альбом по адресам картинок
+        logger.warning(f"Альбом с file_id не принят: {e}")
+        for formatted_recipe, file_id in zip(formatted_recipes, file_ids):
+            if file_id:
+                await db.remove_photo_file_id(formatted_recipe['image'])
+        file_ids = [None] * len(formatted_recipes)
+        messages = await context.bot.send_media_group(chat_id=chat_id, media=album(False), rate_limit_args=BULK_PRIORITY)
+    
+    for formatted_recipe, file_id, message in zip(formatted_recipes, file_ids, messages):
+        if not file_id and message.photo:
+            await db.save_photo_file_id(formatted_recipe['image'], message.photo[-1].file_id)
+    return True
+
+def is_not_modified(error):
+    """Telegram отклонил правку, потому что сообщение не изменилось"""
+    return "not modified" in str(error).lower()
+
+async def edit_recipe_photo(query, image_url, reply_markup, **kwargs):
+    """Замена фотографии сообщения по file_id, а если он не принят - по адресу.
+    
+    Аналог send_recipe_photo для правки сообщения (карусель).
+    """
+    file_id = await db.get_photo_file_id(image_url)
+    if file_id:
+        try:
+            return await query.edit_message_media(InputMediaPhoto(media=file_id, **kwargs), reply_markup=reply_markup)
+        except BadRequest as e:
+            if not is_bad_file_id(e):
+                raise
+            logger.warning(f"file_id для {image_url} не принят: {e}")
+            await db.remove_photo_file_id(image_url)
+    
+    message = await query.edit_message_media(InputMediaPhoto(media=image_url, **kwargs), reply_markup=reply_markup)
+    if isinstance(message, Message) and message.photo:
+        await db.save_photo_file_id(image_url, message.photo[-1].file_id)
+    return message
+
+async def show_carousel_recipe(update: Update, context: ContextTypes.DEFAULT_TYPE, index, recipe_ids):
+    """Перелистывание карусели: сообщение правится на месте одним запросом"""
+    user_id = update.effective_user.id
+    query = update.callback_query
+    
+    if not 0 <= index < len(recipe_ids):
+        logger.warning(f"Позиция карусели {index} вне выдачи из {len(recipe_ids)} рецептов")
+        await query.answer()
         return
     
-    # Получаем полную информацию о рецептах
-    full_recipes = []
-    for recipe in recipes[:5]:  # Ограничиваем до 5 рецептов
-        recipe_details = api.get_recipe_details(recipe['idMeal'])
-        if "error" not in recipe_details:
-            full_recipes.append(recipe_details)
+    recipe = await api.get_recipe_details(recipe_ids[index])
+    if "error" in recipe:
+        await query.answer("❌ Ошибка при получении рецепта!")
+        return
     
-    if not full_recipes:
-        await update.callback_query.edit_message_text("😔 Не удалось загрузить рецепты.")
+    await query.answer()
+    formatted_recipe = api.format_recipe_info(recipe)
+    reply_markup = await get_recipe_keyboard(user_id, formatted_recipe['recipe_id'], carousel=(index, recipe_ids))
+    
+    try:
+        if query.message.photo and formatted_recipe['image']:
+            await edit_recipe_photo(
+                query,
+                formatted_recipe['image'],
+                reply_markup,
+                caption=formatted_recipe['text'],
+                parse_mode=ParseMode.HTML
+            )
+        else:
+            await query.edit_message_text(
+                formatted_recipe['text'],
+                parse_mode=ParseMode.HTML,
+                reply_markup=reply_markup
+            )
+    except BadRequest as e:
+        if not is_not_modified(e):
+            raise
+        # Нажата кнопка текущей позиции - сообщение не изменилось
+        logger.debug(f"Карусель не обновлена: {e}")
+
+async def send_recipe_photo(context: ContextTypes.DEFAULT_TYPE, chat_id, image_url, **kwargs):
+    """Отправка фотографии рецепта.
+    
+    Если картинка уже загружалась в Telegram, отправляется ее file_id и
+    Telegram не скачивает ее заново с TheMealDB. После первой отправки
+    file_id сохраняется в базе.
+    """
+    file_id = await db.get_photo_file_id(image_url)
+    if file_id:
+        try:
+            return await context.bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+        except BadRequest as e:
+            # file_id привязан к боту и может стать недействительным; другие
+            # ошибки (подпись, разметка) повторная отправка не исправит
+            if not is_bad_file_id(e):
+                raise
+            logger.warning(f"file_id для {image_url} не принят: {e}")
+            await db.remove_photo_file_id(image_url)
+    
+    message = await context.bot.send_photo(chat_id=chat_id, photo=image_url, **kwargs)
+    if message.photo:
+        await db.save_photo_file_id(image_url, message.photo[-1].file_id)
+    return message
+
+async def send_recipe_card(context: ContextTypes.DEFAULT_TYPE, chat_id, user_id, recipe, favorites=None, carousel=None):
+    """Отправка карточки рецепта с клавиатурой действий.
+    
+    favorites - статусы избранного, заранее полученные одним запросом на всю выдачу.
+    Карточка уходит сразу, ссылки на видео добавляются позже правкой сообщения.
+    carousel - (позиция, id рецептов) для карусели; ее карточка видео не дополняется,
+    чтобы выдача стоила один запрос к Telegram.
+    """
+    formatted_recipe = api.format_recipe_info(recipe)
+    reply_markup = await get_recipe_keyboard(user_id, formatted_recipe['recipe_id'], favorites, carousel)
+    
+    if formatted_recipe['image']:
+        message = await send_recipe_photo(
+            context,
+            chat_id,
+            formatted_recipe['image'],
+            caption=formatted_recipe['text'],
+            parse_mode=ParseMode.HTML,
+            reply_markup=reply_markup,
+            rate_limit_args=BULK_PRIORITY
+        )
+    else:
+        message = await context.bot.send_message(
+            chat_id=chat_id,
+            text=formatted_recipe['text'],
+            parse_mode=ParseMode.HTML,
+            reply_markup=reply_markup,
+            rate_limit_args=BULK_PRIORITY
+        )
+    
+    if carousel is None:
+        context.application.create_task(attach_recipe_videos(message, user_id, recipe))
+    return message
+
+async def attach_recipe_videos(message, user_id, recipe):
+    """Поиск видео для отправленной карточки и добавление ссылок в нее"""
+    videos = await api.video_search.search_all_videos(recipe.get('strMeal', ''))
+    if not videos:
         return
     
-    # Отправляем рецепты
-    for recipe in full_recipes:
-        formatted_recipe = api.format_recipe_info(recipe)
-        is_favorite = db.is_favorite_recipe(user_id, formatted_recipe['recipe_id'])
-        rating = db.get_recipe_rating(user_id, formatted_recipe['recipe_id']) if is_favorite else 0
-        
-        if formatted_recipe['image']:
-            await context.bot.send_photo(
-                chat_id=update.effective_chat.id,
-                photo=formatted_recipe['image'],
+    formatted_recipe = api.format_recipe_info(recipe, videos)
+    # Клавиатуру строим заново: пока искали видео, рецепт могли добавить в избранное
+    reply_markup = await get_recipe_keyboard(user_id, formatted_recipe['recipe_id'])
+    
+    # Правка через бота, а не message.edit_*, чтобы передать низкий приоритет
+    bot = message.get_bot()
+    try:
+        if message.photo:
+            await bot.edit_message_caption(
+                chat_id=message.chat_id,
+                message_id=message.message_id,
                 caption=formatted_recipe['text'],
                 parse_mode=ParseMode.HTML,
-                reply_markup=get_recipe_actions_keyboard(
-                    formatted_recipe['recipe_id'], 
-                    is_favorite,
-                    rating
-                )
+                reply_markup=reply_markup,
+                rate_limit_args=BULK_PRIORITY
             )
         else:
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=formatted_recipe['text'],
+            await bot.edit_message_text(
+                formatted_recipe['text'],
+                chat_id=message.chat_id,
+                message_id=message.message_id,
                 parse_mode=ParseMode.HTML,
-                reply_markup=get_recipe_actions_keyboard(
-                    formatted_recipe['recipe_id'], 
-                    is_favorite,
-                    rating
-                )
+                reply_markup=reply_markup,
+                rate_limit_args=BULK_PRIORITY
             )
+    except TelegramError as e:
+        # Сообщение могли удалить или заменить списком видео
+        logger.debug(f"Не удалось добавить видео в карточку: {e}")
+
+async def send_recipe_details_as_ready(update: Update, context: ContextTypes.DEFAULT_TYPE, recipes):
+    """Параллельная загрузка деталей рецептов, карточки отправляются по мере готовности"""
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+    semaphore = asyncio.Semaphore(DETAILS_FETCH_CONCURRENCY)
+    
+    async def fetch_details(recipe):
+        async with semaphore:
+            return await api.get_recipe_details(recipe['idMeal'])
+    
+    if RESULTS_MODE != 'cards':
+        # Компактной выдаче нужны все рецепты сразу
+        details = await asyncio.gather(*(fetch_details(recipe) for recipe in recipes))
+        details = [recipe_details for recipe_details in details if "error" not in recipe_details]
+        if details:
+            await send_results(update, context, details)
+        return len(details)
+    
+    favorites = await db.get_favorites_status(user_id, [recipe['idMeal'] for recipe in recipes])
+    tasks = [asyncio.create_task(fetch_details(recipe)) for recipe in recipes]
+    sent = 0
+    
+    try:
+        for next_ready in asyncio.as_completed(tasks):
+            recipe_details = await next_ready
+            if "error" in recipe_details:
+                continue
+            await send_recipe_card(context, chat_id, user_id, recipe_details, favorites)
+            sent += 1
+    finally:
+        # Если отправка упала, не оставляем висящих запросов
+        for task in tasks:
+            task.cancel()
+    
+    return sent
+
+async def search_by_category(update: Update, context: ContextTypes.DEFAULT_TYPE, category):
+    """Поиск рецептов по категории"""
+    user_id = update.effective_user.id
+    user_states.set(user_id, "search_results")
+    
+    await update.callback_query.edit_message_text(f"🏷️ Ищу рецепты в категории '{category}'...")
+    
+    recipes = await api.get_recipes_by_category(category)
+    
+    if "error" in recipes:
+        await update.callback_query.edit_message_text(f"❌ Ошибка: {recipes['error']}")
+        return
+    
+    if not recipes:
+        await update.callback_query.edit_message_text("😔 Рецепты не найдены в этой категории.")
+        return
+    
+    # Загружаем детали параллельно и отправляем каждый рецепт по готовности
+    sent = await send_recipe_details_as_ready(update, context, recipes[:MAX_RECIPES_PER_SEARCH])
+    
+    if not sent:
+        await update.callback_query.edit_message_text("😔 Не удалось загрузить рецепты.")
 
 async def search_by_area(update: Update, context: ContextTypes.DEFAULT_TYPE, area):
     """Поиск рецептов по кухне"""
     user_id = update.effective_user.id
-    user_states[user_id] = "search_results"
+    user_states.set(user_id, "search_results")
     
     await update.callback_query.edit_message_text(f"🌍 Ищу рецепты кухни '{area}'...")
     
-    recipes = api.get_recipes_by_area(area)
+    recipes = await api.get_recipes_by_area(area)
     
     if "error" in recipes:
         await update.callback_query.edit_message_text(f"❌ Ошибка: {recipes['error']}")
@@ -555,46 +843,55 @@ async def search_by_area(update: Update, context: ContextTypes.DEFAULT_TYPE, are
         await update.callback_query.edit_message_text("😔 Рецепты не найдены в этой кухне.")
         return
     
-    # Получаем полную информацию о рецептах
-    full_recipes = []
-    for recipe in recipes[:5]:  # Ограничиваем до 5 рецептов
-        recipe_details = api.get_recipe_details(recipe['idMeal'])
-        if "error" not in recipe_details:
-            full_recipes.append(recipe_details)
+    # Загружаем детали параллельно и отправляем каждый рецепт по готовности
+    sent = await send_recipe_details_as_ready(update, context, recipes[:MAX_RECIPES_PER_SEARCH])
     
-    if not full_recipes:
+    if not sent:
         await update.callback_query.edit_message_text("😔 Не удалось загрузить рецепты.")
+
+async def ask_ingredients(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Запросить список ингредиентов"""
+    user_id = update.effective_user.id
+    user_states.set(user_id, "waiting_for_ingredients")
+    
+    message = """
+🥕 <b>Поиск по ингредиентам</b>
+
+Напишите, какие продукты у вас есть, через запятую.
+Например: <i>chicken, rice, garlic</i>
+    """.strip()
+    
+    await update.callback_query.edit_message_text(
+        message,
+        parse_mode=ParseMode.HTML
+    )
+
+async def search_by_ingredients(update: Update, context: ContextTypes.DEFAULT_TYPE, text):
+    """Поиск рецептов по ингредиентам"""
+    user_id = update.effective_user.id
+    
+    await update.message.reply_text("🥕 Подбираю рецепты из ваших продуктов...")
+    
+    recipes = await api.search_by_ingredients(text)
+    
+    if "error" in recipes:
+        await update.message.reply_text(f"❌ Ошибка: {recipes['error']}")
         return
     
-    # Отправляем рецепты
-    for recipe in full_recipes:
-        formatted_recipe = api.format_recipe_info(recipe)
-        is_favorite = db.is_favorite_recipe(user_id, formatted_recipe['recipe_id'])
-        rating = db.get_recipe_rating(user_id, formatted_recipe['recipe_id']) if is_favorite else 0
-        
-        if formatted_recipe['image']:
-            await context.bot.send_photo(
-                chat_id=update.effective_chat.id,
-                photo=formatted_recipe['image'],
-                caption=formatted_recipe['text'],
-                parse_mode=ParseMode.HTML,
-                reply_markup=get_recipe_actions_keyboard(
-                    formatted_recipe['recipe_id'], 
-                    is_favorite,
-                    rating
-                )
-            )
-        else:
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=formatted_recipe['text'],
-                parse_mode=ParseMode.HTML,
-                reply_markup=get_recipe_actions_keyboard(
-                    formatted_recipe['recipe_id'], 
-                    is_favorite,
-                    rating
-                )
-            )
+    if not recipes:
+        await update.message.reply_text(
+            "😔 Не нашел рецептов с этими ингредиентами. Попробуйте другие продукты.",
+            reply_markup=get_main_menu_keyboard()
+        )
+        return
+    
+    sent = await send_recipe_details_as_ready(update, context, recipes)
+    
+    if not sent:
+        await update.message.reply_text("😔 Не удалось загрузить рецепты.")
+        return
+    
+    user_states.set(user_id, "search_results")
 
 async def back_to_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Вернуться в главное меню"""
@@ -610,6 +907,64 @@ async def back_to_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=get_main_menu_keyboard()
         )
 
+async def on_startup(application: Application):
+    """Прогрев кэшей при запуске бота.
+    
+    В режиме webhook выполняется только в одном рабочем процессе, остальные
+    запускаются через on_worker_startup.
+    """
+    api.start_listing_refresh()
+    db.start_write_behind()
+    for name, plan in (await db.check_query_plans()).items():
+        logger.warning(f"Запрос {name} выполняется без индекса: {'; '.join(plan)}")
+    api.start_similar_rebuild()
+
+async def on_worker_startup(application: Application):
+    """Запуск рабочего процесса webhook без общих фоновых задач.
+    
+    Списки обновляет и похожие рецепты рассчитывает другой процесс, здесь
+    обновленные списки только перечитываются из общего cache.db.
+    """
+    api.start_listing_reload()
+    db.start_write_behind()
+
+async def on_shutdown(application: Application):
+    """Освобождение ресурсов при остановке бота"""
+    logger.info(f"Статистика кэша рецептов: {api.cache.stats()}")
+    logger.info(f"Статистика кэша списков: {api.listings.stats()}")
+    logger.info(f"Статистика кэша видео: {api.video_search.cache.stats()}")
+    logger.info(f"Объединенные запросы к TheMealDB: {api.flights.stats()}, к сервисам видео: {api.video_search.flights.stats()}")
+    await api.close()
+    await db.close()
+    user_states.close()
+
+def build_application(updater=True, send_rate=SEND_GLOBAL_RATE, shared_jobs=True):
+    """Приложение бота со всеми обработчиками.
+    
+    updater=False - для рабочих процессов webhook.py, которые получают
+    обновления от главного процесса, а не от Telegram напрямую.
+    send_rate - доля общего лимита отправки, доступная этому процессу.
+    shared_jobs=False - не запускать общие фоновые задачи (обновление списков,
+    расчет похожих рецептов): в режиме webhook их выполняет один процесс.
+    """
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .post_init(on_startup if shared_jobs else on_worker_startup)
+        .post_shutdown(on_shutdown)
+        .persistence(StateStorePersistence())
+        .rate_limiter(MessageScheduler(send_rate))
+    )
+    if not updater:
+        builder = builder.updater(None)
+    application = builder.build()
+    
+    # Добавляем обработчики
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CallbackQueryHandler(handle_callback))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    return application
+
 def main():
     """Запуск бота"""
     if not TELEGRAM_TOKEN:
@@ -617,12 +972,7 @@ def main():
         return
     
     # Создаем приложение
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
-    
-    # Добавляем обработчики
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CallbackQueryHandler(handle_callback))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application = build_application()
     
     # Запускаем бота
     logger.info("Бот запущен!")
@@ -0,0 +1,535 @@
+import asyncio
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from config import (
+    CACHE_DATABASE_NAME,
+    CACHE_WRITE_INTERVAL,
+    CACHE_WRITE_BATCH,
+    RECIPE_CACHE_MEMORY_SIZE,
+    RECIPE_CACHE_MAX_ROWS,
+    RECIPE_CACHE_TTL,
+    RECIPE_CACHE_STALE_TTL,
+    VIDEO_CACHE_TTL,
+    VIDEO_CACHE_DEFAULT_TTL,
+    VIDEO_CACHE_NEGATIVE_TTL,
+    VIDEO_CACHE_MEMORY_SIZE,
+    VIDEO_CACHE_MAX_ROWS,
+    DB_BUSY_TIMEOUT
+)
+from models import Recipe
+
+logger = logging.getLogger(__name__)
+
+WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize_query(query):
+    """Ключ кэша для поискового запроса: 'Beef  Wellington!' -> 'beef wellington'"""
+    return ' '.join(WORD_PATTERN.findall(query.lower()))
+
+
+class LRUCache:
+    """Кэш в памяти с вытеснением давно неиспользуемых записей и TTL"""
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_entry(self, key):
+        """Получение записи (значение, время сохранения) без проверки TTL"""
+        entry = self._data.get(key)
+        if entry is not None:
+            self._data.move_to_end(key)
+        return entry
+
+    def get(self, key, default=None):
+        """Получение свежего значения по ключу"""
+        entry = self.get_entry(key)
+        if entry is None or (self.ttl is not None and time.time() - entry[1] > self.ttl):
+            self.misses += 1
+            return default
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, stored_at=None):
+        """Сохранение значения с вытеснением самых старых записей"""
+        self._data[key] = (value, stored_at if stored_at is not None else time.time())
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Удаление записи"""
+        entry = self._data.pop(key, None)
+        return entry[0] if entry is not None else default
+
+    def clear(self):
+        """Очистка кэша"""
+        self._data.clear()
+
+    def items(self):
+        """Неистекшие записи (ключ, значение) без изменения порядка вытеснения"""
+        now = time.time()
+        return [
+            (key, value) for key, (value, stored_at) in list(self._data.items())
+            if self.ttl is None or now - stored_at <= self.ttl
+        ]
+
+    def expire(self):
+        """Удаление записей старше ttl, возвращает их число"""
+        if self.ttl is None:
+            return 0
+        now = time.time()
+        expired = [key for key, (_, stored_at) in self._data.items() if now - stored_at > self.ttl]
+        for key in expired:
+            del self._data[key]
+        return len(expired)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TableWriter:
+    """Пакетная запись в таблицу SQLite вне event loop.
+
+    Записи копятся в памяти (по ключу, более новая заменяет старую) и
+    сбрасываются одной транзакцией через отдельное соединение в пуле потоков:
+    через interval секунд после первой записи или сразу при накоплении
+    batch_size записей. row превращает накопленное значение в параметры
+    запроса и выполняется тоже в потоке. sql может быть списком запросов,
+    тогда row возвращает параметры для каждого из них, и запросы выполняются
+    по очереди для всего пакета. Без запущенного event loop
+    (утилиты командной строки) полный пакет пишется синхронно.
+    """
+
+    def __init__(self, db_name, sql, row, on_flush=None, interval=CACHE_WRITE_INTERVAL,
+                 batch_size=CACHE_WRITE_BATCH):
+        self.sql = sql
+        self.row = row
+        self.on_flush = on_flush
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pending = {}
+        self.writing = {}
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._timer = None
+        self._future = None
+
+        self.conn = sqlite3.connect(db_name, check_same_thread=False)
+        self.conn.execute(f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT}')
+
+    def add(self, key, value):
+        """Постановка записи в очередь"""
+        with self._pending_lock:
+            self.pending[key] = value
+            full = len(self.pending) >= self.batch_size
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            if full:
+                self.flush()
+            return
+
+        if full:
+            self._start_flush(loop)
+        elif self._timer is None:
+            self._timer = loop.call_later(self.interval, self._start_flush, loop)
+
+    def get(self, key):
+        """Еще не записанное в базу значение или None"""
+        value = self.pending.get(key)
+        return value if value is not None else self.writing.get(key)
+
+    def _start_flush(self, loop):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._future is not None and not self._future.done():
+            # Пакет уже пишется, остаток заберем следующим
+            self._timer = loop.call_later(self.interval, self._start_flush, loop)
+            return
+        self._future = loop.run_in_executor(None, self.flush)
+        self._future.add_done_callback(lambda future: self._flush_done(future, loop))
+
+    def _flush_done(self, future, loop):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logger.error(f"Ошибка пакетной записи в кэш: {future.exception()}")
+        if self.pending and self._timer is None and not loop.is_closed():
+            self._timer = loop.call_later(self.interval, self._start_flush, loop)
+
+    def flush(self):
+        """Запись всех накопленных значений одной транзакцией, возвращает их число"""
+        with self._write_lock:
+            with self._pending_lock:
+                # writing заполняется раньше, чем очищается pending, чтобы get
+                # не пропустил записи в момент переключения
+                batch = self.writing = self.pending
+                self.pending = {}
+            if not batch:
+                return 0
+
+            try:
+                rows = [self.row(key, value) for key, value in batch.items()]
+                with self.conn:
+                    if isinstance(self.sql, str):
+                        self.conn.executemany(self.sql, rows)
+                    else:
+                        for position, sql in enumerate(self.sql):
+                            self.conn.executemany(sql, [row[position] for row in rows])
+                    if self.on_flush is not None:
+                        self.on_flush(self.conn, len(batch))
+            except Exception:
+                # Возвращаем записи в очередь, не затирая более новые
+                with self._pending_lock:
+                    self.pending = {**batch, **self.pending}
+                raise
+            finally:
+                self.writing = {}
+            return len(batch)
+
+    def close(self):
+        """Запись остатка и закрытие соединения"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self.flush()
+        self.conn.close()
+
+
+class RecipeCache:
+    """Двухуровневый кэш деталей рецептов: LRU в памяти и таблица SQLite.
+
+    Рецепты хранятся и возвращаются как компактные объекты Recipe.
+    """
+
+    def __init__(self, db_name=CACHE_DATABASE_NAME, memory_size=RECIPE_CACHE_MEMORY_SIZE,
+                 max_rows=RECIPE_CACHE_MAX_ROWS, ttl=RECIPE_CACHE_TTL, stale_ttl=RECIPE_CACHE_STALE_TTL):
+        self.memory = LRUCache(memory_size)
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._puts_since_evict = 0
+        self.db_name = db_name
+
+        self.conn = sqlite3.connect(db_name, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS recipe_details (
+                recipe_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+        ''')
+        self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_recipe_details_fetched_at
+            ON recipe_details (fetched_at)
+        ''')
+        self.conn.commit()
+
+        # Записи уходят в базу пакетами из пула потоков
+        self.writer = TableWriter(
+            db_name,
+            'INSERT OR REPLACE INTO recipe_details (recipe_id, data, fetched_at) VALUES (?, ?, ?)',
+            lambda key, entry: (key, json.dumps(entry[0].to_api(), ensure_ascii=False), entry[1]),
+            on_flush=self._evict_after_flush
+        )
+
+    def get(self, recipe_id):
+        """Получение рецепта из кэша.
+
+        Возвращает пару (рецепт, свежий ли он). Устаревший рецепт отдается,
+        пока не истек stale_ttl, чтобы вызывающий код мог обновить его в фоне.
+        """
+        key = str(recipe_id)
+        entry = self.memory.get_entry(key) or self.writer.get(key)
+
+        if entry is None:
+            row = self.conn.execute(
+                'SELECT data, fetched_at FROM recipe_details WHERE recipe_id = ?',
+                (key,)
+            ).fetchone()
+            if row:
+                entry = (Recipe.from_api(json.loads(row[0])), row[1])
+                self.memory.set(key, entry[0], stored_at=entry[1])
+
+        if entry is not None:
+            age = time.time() - entry[1]
+            if age <= self.ttl:
+                self.hits += 1
+                return entry[0], True
+            if age <= self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                return entry[0], False
+
+        self.misses += 1
+        return None, False
+
+    def put(self, recipe):
+        """Сохранение полного рецепта в память и в очередь записи в SQLite"""
+        recipe = Recipe.from_api(recipe)
+        key = recipe.id
+        fetched_at = time.time()
+        self.memory.set(key, recipe, stored_at=fetched_at)
+        self.writer.add(key, (recipe, fetched_at))
+
+    def flush(self):
+        """Запись накопленных рецептов в SQLite"""
+        return self.writer.flush()
+
+    def all_recipes(self, conn=None):
+        """Все рецепты из SQLite кэша.
+
+        conn - отдельное соединение для чтения из пула потоков.
+        """
+        self.flush()
+        conn = conn or self.conn
+        for (data,) in conn.execute('SELECT data FROM recipe_details'):
+            yield Recipe.from_api(json.loads(data))
+
+    def get_stored(self, recipe_id):
+        """Рецепт из SQLite кэша и время его загрузки, без учета TTL и счетчиков"""
+        entry = self.writer.get(str(recipe_id))
+        if entry is not None:
+            return entry
+        row = self.conn.execute(
+            'SELECT data, fetched_at FROM recipe_details WHERE recipe_id = ?',
+            (str(recipe_id),)
+        ).fetchone()
+        if row is None:
+            return None, None
+        return Recipe.from_api(json.loads(row[0])), row[1]
+
+    def touch(self, recipe_ids, fetched_at=None):
+        """Продление срока жизни рецептов, которые не изменились в API"""
+        fetched_at = fetched_at if fetched_at is not None else time.time()
+        keys = [str(recipe_id) for recipe_id in recipe_ids]
+        self.flush()
+        with self.writer.conn:
+            self.writer.conn.executemany(
+                'UPDATE recipe_details SET fetched_at = ? WHERE recipe_id = ?',
+                [(fetched_at, key) for key in keys]
+            )
+        for key in keys:
+            entry = self.memory.get_entry(key)
+            if entry is not None:
+                self.memory.set(key, entry[0], stored_at=fetched_at)
+
+    def _evict_after_flush(self, conn, count):
+        # Проверяем размер таблицы не на каждой записи
+        self._puts_since_evict += count
+        if self._puts_since_evict >= 100:
+            self._puts_since_evict = 0
+            self.evict(conn)
+
+    def evict(self, conn=None):
+        """Удаление самых старых рецептов сверх max_rows"""
+        conn = conn or self.conn
+        conn.execute('''
+            DELETE FROM recipe_details WHERE recipe_id IN (
+                SELECT recipe_id FROM recipe_details
+                ORDER BY fetched_at DESC
+                LIMIT -1 OFFSET ?
+            )
+        ''', (self.max_rows,))
+        conn.commit()
+
+    def stats(self):
+        """Счетчики попаданий и промахов"""
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'memory_size': len(self.memory)
+        }
+
+    def close(self):
+        """Запись накопленных рецептов и закрытие соединений с базой кэша"""
+        self.writer.close()
+        self.conn.close()
+
+
+class ListingCache:
+    """Кэш списков TheMealDB в памяти с копией в SQLite.
+
+    Списки почти не меняются, поэтому отдаются без проверки TTL:
+    актуальность поддерживает фоновое обновление.
+    """
+
+    def __init__(self, db_name=CACHE_DATABASE_NAME):
+        self._data = {}
+        self.hits = 0
+        self.misses = 0
+
+        self.conn = sqlite3.connect(db_name, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS listings (
+                listing_key TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+        ''')
+        self.conn.commit()
+
+        self.writer = TableWriter(
+            db_name,
+            'INSERT OR REPLACE INTO listings (listing_key, data, fetched_at) VALUES (?, ?, ?)',
+            lambda key, entry: (key, json.dumps(entry[0], ensure_ascii=False), entry[1])
+        )
+
+        # Поднимаем сохраненные списки, чтобы меню работали сразу после рестарта
+        self.reload()
+
+    def reload(self):
+        """Перечитывание списков из SQLite (их может обновлять другой процесс)"""
+        self.writer.flush()
+        for key, data in self.conn.execute('SELECT listing_key, data FROM listings'):
+            self._data[key] = json.loads(data)
+
+    def get(self, key):
+        """Получение списка по ключу"""
+        if key in self._data:
+            self.hits += 1
+            return self._data[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, listing):
+        """Сохранение списка (в SQLite - пакетной записью)"""
+        self._data[key] = listing
+        self.writer.add(key, (listing, time.time()))
+
+    def keys(self):
+        """Ключи всех закэшированных списков"""
+        return list(self._data)
+
+    def stats(self):
+        """Счетчики попаданий и промахов"""
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
+
+    def close(self):
+        """Запись накопленных списков и закрытие соединений с базой кэша"""
+        self.writer.close()
+        self.conn.close()
+
+
+class VideoCache:
+    """Кэш результатов поиска видео по сервису и нормализованному запросу.
+
+    Пустые результаты тоже кэшируются, но на меньший срок.
+    """
+
+    def __init__(self, db_name=CACHE_DATABASE_NAME, memory_size=VIDEO_CACHE_MEMORY_SIZE,
+                 max_rows=VIDEO_CACHE_MAX_ROWS, ttl=None, default_ttl=VIDEO_CACHE_DEFAULT_TTL,
+                 negative_ttl=VIDEO_CACHE_NEGATIVE_TTL):
+        self.memory = LRUCache(memory_size)
+        self.max_rows = max_rows
+        self.ttl = ttl if ttl is not None else VIDEO_CACHE_TTL
+        self.default_ttl = default_ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._puts_since_evict = 0
+
+        self.conn = sqlite3.connect(db_name, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS video_cache (
+                platform TEXT NOT NULL,
+                query_key TEXT NOT NULL,
+                data TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (platform, query_key)
+            )
+        ''')
+        self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_video_cache_fetched_at
+            ON video_cache (fetched_at)
+        ''')
+        self.conn.commit()
+
+        self.writer = TableWriter(
+            db_name,
+            'INSERT OR REPLACE INTO video_cache (platform, query_key, data, fetched_at) VALUES (?, ?, ?, ?)',
+            lambda key, entry: (*key, json.dumps(entry[0], ensure_ascii=False), entry[1]),
+            on_flush=self._evict_after_flush
+        )
+
+    def _ttl_for(self, platform, videos):
+        if not videos:
+            return self.negative_ttl
+        return self.ttl.get(platform, self.default_ttl)
+
+    def get(self, platform, query):
+        """Закэшированные видео или None, если записи нет или она устарела"""
+        key = (platform, normalize_query(query))
+        entry = self.memory.get_entry(key) or self.writer.get(key)
+
+        if entry is None:
+            row = self.conn.execute(
+                'SELECT data, fetched_at FROM video_cache WHERE platform = ? AND query_key = ?',
+                key
+            ).fetchone()
+            if row:
+                entry = (json.loads(row[0]), row[1])
+                self.memory.set(key, entry[0], stored_at=entry[1])
+
+        if entry is not None and time.time() - entry[1] <= self._ttl_for(platform, entry[0]):
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        return None
+
+    def put(self, platform, query, videos):
+        """Сохранение результатов поиска (в том числе пустых)"""
+        key = (platform, normalize_query(query))
+        fetched_at = time.time()
+        self.memory.set(key, videos, stored_at=fetched_at)
+        self.writer.add(key, (videos, fetched_at))
+
+    def _evict_after_flush(self, conn, count):
+        self._puts_since_evict += count
+        if self._puts_since_evict >= 100:
+            self._puts_since_evict = 0
+            self.evict(conn)
+
+    def evict(self, conn=None):
+        """Удаление самых старых записей сверх max_rows"""
+        conn = conn or self.conn
+        conn.execute('''
+            DELETE FROM video_cache WHERE rowid IN (
+                SELECT rowid FROM video_cache
+                ORDER BY fetched_at DESC
+                LIMIT -1 OFFSET ?
+            )
+        ''', (self.max_rows,))
+        conn.commit()
+
+    def stats(self):
+        """Счетчики попаданий и промахов"""
+        return {'hits': self.hits, 'misses': self.misses, 'memory_size': len(self.memory)}
+
+    def close(self):
+        """Запись накопленных результатов и закрытие соединений с базой кэша"""
+        self.writer.close()
+        self.conn.close()
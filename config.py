@@ -15,8 +15,94 @@ RUTUBE_API_TOKEN = os.getenv('RUTUBE_API_TOKEN', '')  # Rutube API токен (
 
 # Database
 DATABASE_NAME = 'recipes.db'
+CACHE_DATABASE_NAME = os.path.join(os.path.dirname(os.path.abspath(DATABASE_NAME)), 'cache.db')  # Кэш данных TheMealDB рядом с recipes.db
+STATE_DATABASE_NAME = os.path.join(os.path.dirname(os.path.abspath(DATABASE_NAME)), 'state.db')  # Состояния диалогов пользователей
 
 # Bot settings
 MAX_RECIPES_PER_SEARCH = 5
 MAX_FAVORITES_PER_USER = 50
+FAVORITES_PAGE_SIZE = 10  # Рецептов на одной странице избранного
 MAX_VIDEO_RESULTS = 3  # Максимальное количество видео для каждого сервиса
+RESULTS_MODE = os.getenv('RESULTS_MODE', 'cards')  # 'cards' - карточка на рецепт, 'album' - один альбом, 'carousel' - одно сообщение с перелистыванием
+
+# HTTP client (общий пул соединений для асинхронных запросов)
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', '100'))  # Всего соединений в пуле
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv('HTTP_MAX_CONNECTIONS_PER_HOST', '20'))  # Одновременных запросов к одному хосту
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('HTTP_MAX_KEEPALIVE_CONNECTIONS', '20'))  # Соединений, которые держим открытыми
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', '30'))  # Секунд простоя до закрытия соединения
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '10'))
+DETAILS_FETCH_CONCURRENCY = 5  # Одновременных запросов деталей рецептов на одну выдачу
+RANDOM_FETCH_TIMEOUT = 3  # Секунд ожидания random.php, после чего добираем рецепты из локального пула
+RANDOM_EXTRA_REQUESTS = 2  # Дополнительных запросов random.php на случай повторов
+KNOWN_RECIPES_POOL_SIZE = 500  # Сколько уже полученных рецептов держим для случайной выдачи
+RENDER_CACHE_SIZE = 2000  # Разобранных карточек рецептов в памяти
+KEYBOARD_CACHE_SIZE = 4096  # Готовых клавиатур действий с рецептом
+
+# Кэш деталей рецептов
+RECIPE_CACHE_MEMORY_SIZE = 2000  # Рецептов в памяти процесса (LRU)
+RECIPE_CACHE_MAX_ROWS = 50000  # Рецептов в SQLite кэше
+RECIPE_CACHE_TTL = 24 * 60 * 60  # Секунд, в течение которых рецепт считается свежим
+RECIPE_CACHE_STALE_TTL = 7 * 24 * 60 * 60  # Сколько еще отдаем устаревший рецепт, обновляя его в фоне
+CACHE_WRITE_INTERVAL = 1  # Секунд, за которые записи в cache.db копятся перед пакетной записью
+CACHE_WRITE_BATCH = 200  # При таком числе накопленных записей пишем сразу
+
+# Кэш списков (категории, кухни, рецепты по категории/кухне)
+LISTING_REFRESH_INTERVAL = 6 * 60 * 60  # Секунд между фоновыми обновлениями списков
+LISTING_RELOAD_INTERVAL = 10 * 60  # Секунд между перечитываниями списков из cache.db в остальных процессах webhook
+
+# Синхронизация каталога TheMealDB (sync_catalog.py)
+SYNC_REQUESTS_PER_SECOND = 5  # Ограничение частоты запросов lookup.php
+SYNC_CONCURRENCY = 5  # Одновременных запросов при синхронизации
+
+# Похожие рецепты
+SIMILAR_RECIPES_TOP_K = 10  # Сколько соседей предрасчитываем для каждого рецепта
+SIMILAR_RECIPES_SHOWN = 3  # Сколько похожих рецептов показываем по кнопке
+SIMILAR_REBUILD_INTERVAL = 60 * 60  # Секунд между пересчетами похожих рецептов, если появились новые
+SIMILAR_REBUILD_NEW_RECIPES = 100  # Новых рецептов без соседей, после которых пересчет запускается сразу
+VIDEO_SEARCH_DEADLINE = 5  # Секунд на поиск видео по всем сервисам, дальше берем то, что успело прийти
+
+# Кэш результатов поиска видео
+VIDEO_CACHE_TTL = {  # Секунд хранения результатов для каждого сервиса
+    'VK': 24 * 60 * 60,
+    'Rutube': 3 * 24 * 60 * 60
+}
+VIDEO_CACHE_DEFAULT_TTL = 24 * 60 * 60
+VIDEO_CACHE_NEGATIVE_TTL = 60 * 60  # Сколько помним, что видео не нашлось
+VIDEO_CACHE_MEMORY_SIZE = 1000  # Запросов в памяти процесса
+VIDEO_CACHE_MAX_ROWS = 20000  # Запросов в SQLite кэше
+
+# Соединения с базой избранного
+DB_EXECUTOR_WORKERS = 4  # Потоков для запросов к базе (вне event loop)
+DB_BUSY_TIMEOUT = 5000  # Миллисекунд ожидания блокировки базы
+DB_CACHE_SIZE_KB = 8192  # Кэш страниц SQLite на соединение
+DB_STATEMENT_CACHE_SIZE = 128  # Подготовленных запросов на соединение
+FAVORITES_CACHE_USERS = 10000  # Пользователей, чье избранное держим в памяти
+PHOTO_FILE_ID_CACHE_SIZE = 5000  # file_id фотографий рецептов в памяти (все хранятся в recipes.db)
+WRITE_BEHIND_INTERVAL = 2  # Секунд между сбросами отложенных записей (пользователи, рейтинги)
+WRITE_BEHIND_MAX_PENDING = 500  # При таком числе отложенных записей сбрасываем сразу
+
+# Conversation state (режим поиска и данные python-telegram-bot)
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'sqlite')  # 'memory' - только в процессе, 'sqlite' - переживает перезапуск и общий для процессов
+STATE_TTL = 24 * 60 * 60  # Секунд, после которых неактивное состояние забывается
+STATE_MEMORY_SIZE = 10000  # Пользователей в памяти для бэкенда 'memory'
+STATE_MAX_ROWS = 100000  # Записей в SQLite для бэкенда 'sqlite'
+
+# Outbound Telegram requests (лимиты Telegram: ~30 сообщений/с на бота, ~1/с в чат, 20/мин в группу)
+SEND_GLOBAL_RATE = 30  # Запросов к чатам в секунду на бота (в режиме webhook делится между процессами)
+SEND_CHAT_RATE = 1  # Сообщений в секунду в личный чат
+SEND_CHAT_BURST = 5  # Сколько сообщений можно отправить в личный чат подряд (одна выдача)
+SEND_GROUP_RATE = 20 / 60  # Сообщений в секунду в группу
+SEND_GROUP_BURST = 3
+SEND_CHAT_BUCKETS = 10000  # Чатов, для которых помним расход лимита
+SEND_MAX_RETRIES = 3  # Повторов запроса после RetryAfter
+
+# Webhook mode (python webhook.py): прием обновлений и несколько рабочих процессов
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')  # Публичный HTTPS адрес, который регистрируется в Telegram
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')  # Адрес локального HTTP сервера (за reverse proxy)
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')  # Путь, на который reverse proxy передает запросы Telegram
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')  # Обязателен, проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', str(os.cpu_count() or 1)))  # Рабочих процессов бота
+WEBHOOK_RESTART_LIMIT = 5  # Перезапусков упавшего рабочего процесса за WEBHOOK_RESTART_WINDOW, после которых webhook останавливается
+WEBHOOK_RESTART_WINDOW = 60  # Секунд
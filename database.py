@@ -1,19 +1,32 @@
+import asyncio
+import functools
+import logging
 import sqlite3
-from config import DATABASE_NAME
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cache import LRUCache
+from config import (
+    DATABASE_NAME,
+    FAVORITES_CACHE_USERS,
+    PHOTO_FILE_ID_CACHE_SIZE,
+    FAVORITES_PAGE_SIZE,
+    WRITE_BEHIND_INTERVAL,
+    WRITE_BEHIND_MAX_PENDING,
+    DB_EXECUTOR_WORKERS,
+    DB_BUSY_TIMEOUT,
+    DB_CACHE_SIZE_KB,
+    DB_STATEMENT_CACHE_SIZE
+)
 from datetime import datetime
 
-class Database:
-    def __init__(self):
-        self.db_name = DATABASE_NAME
-        self.init_database()
-    
-    def init_database(self):
-        """Инициализация базы данных и создание таблиц"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
+logger = logging.getLogger(__name__)
+
+# Миграции схемы: (версия, список SQL). Версия базы хранится в PRAGMA user_version.
+# Новые изменения схемы добавляются в конец списка, старые не редактируются.
+MIGRATIONS = [
+    (1, [
         # Таблица пользователей
-        cursor.execute('''
+        '''
             CREATE TABLE IF NOT EXISTS users (
                 user_id INTEGER PRIMARY KEY,
                 username TEXT,
@@ -21,10 +34,9 @@ class Database:
                 last_name TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
-        ''')
-        
+        ''',
         # Таблица избранных рецептов
-        cursor.execute('''
+        '''
             CREATE TABLE IF NOT EXISTS favorite_recipes (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER,
@@ -37,72 +49,217 @@ class Database:
                 FOREIGN KEY (user_id) REFERENCES users (user_id),
                 UNIQUE(user_id, recipe_id)
             )
-        ''')
+        '''
+    ]),
+    (2, [
+        # Покрывающий индекс для списка избранного и статусов избранного:
+        # выборка по user_id уже отсортирована и не обращается к таблице
+        '''
+            CREATE INDEX IF NOT EXISTS idx_favorites_user_rating
+            ON favorite_recipes (
+                user_id, rating DESC, added_at DESC,
+                recipe_id, recipe_title, recipe_image, recipe_url
+            )
+        '''
+    ]),
+    (3, [
+        # Постраничный вывод избранного идет по ключу (rating, added_at, id),
+        # поэтому id включен в индекс сразу после полей сортировки
+        'DROP INDEX IF EXISTS idx_favorites_user_rating',
+        '''
+            CREATE INDEX IF NOT EXISTS idx_favorites_user_page
+            ON favorite_recipes (
+                user_id, rating DESC, added_at DESC, id DESC,
+                recipe_id, recipe_title, recipe_image, recipe_url
+            )
+        '''
+    ]),
+    (4, [
+        # file_id фотографий, уже загруженных в Telegram, по адресу картинки
+        '''
+            CREATE TABLE IF NOT EXISTS photo_file_ids (
+                image_url TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        '''
+    ])
+]
+
+# Частые запросы для проверки планов выполнения (check_query_plans)
+HOT_QUERIES = {
+    'get_favorite_recipes': ('''
+        SELECT recipe_id, recipe_title, recipe_image, recipe_url, rating, added_at
+        FROM favorite_recipes
+        WHERE user_id = ?
+        ORDER BY rating DESC, added_at DESC, id DESC
+    ''', (0,)),
+    'get_favorite_recipes_page_next': ('''
+        SELECT id, recipe_id, recipe_title, recipe_image, recipe_url, rating, added_at
+        FROM favorite_recipes
+        WHERE user_id = ? AND (rating, added_at, id) < (?, ?, ?)
+        ORDER BY rating DESC, added_at DESC, id DESC
+        LIMIT ?
+    ''', (0, 0, '', 0, 10)),
+    'get_favorite_recipes_page_prev': ('''
+        SELECT id, recipe_id, recipe_title, recipe_image, recipe_url, rating, added_at
+        FROM favorite_recipes
+        WHERE user_id = ? AND (rating, added_at, id) > (?, ?, ?)
+        ORDER BY rating ASC, added_at ASC, id ASC
+        LIMIT ?
+    ''', (0, 0, '', 0, 10)),
+    'get_favorites_status': ('''
+        SELECT recipe_id, rating FROM favorite_recipes
+        WHERE user_id = ?
+    ''', (0,)),
+    'get_favorites_status_list': ('''
+        SELECT recipe_id, rating FROM favorite_recipes
+        WHERE user_id = ? AND recipe_id IN (?, ?)
+    ''', (0, 0, 0)),
+    'count_favorite_recipes': ('''
+        SELECT COUNT(*) FROM favorite_recipes
+        WHERE user_id = ?
+    ''', (0,)),
+    'get_recipe_rating': ('''
+        SELECT rating FROM favorite_recipes
+        WHERE user_id = ? AND recipe_id = ?
+    ''', (0, 0)),
+    'update_recipe_rating': ('''
+        UPDATE favorite_recipes SET rating = ?
+        WHERE user_id = ? AND recipe_id = ?
+    ''', (0, 0, 0)),
+    'remove_favorite_recipe': ('''
+        DELETE FROM favorite_recipes
+        WHERE user_id = ? AND recipe_id = ?
+    ''', (0, 0))
+}
+
+class Database:
+    def __init__(self):
+        self.db_name = DATABASE_NAME
+        # У каждого потока свое постоянное соединение
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self.init_database()
+    
+    def _connection(self):
+        """Постоянное соединение текущего потока"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_name,
+                check_same_thread=False,
+                cached_statements=DB_STATEMENT_CACHE_SIZE
+            )
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT}')
+            conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+            conn.execute('PRAGMA temp_store=MEMORY')
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+    
+    def close(self):
+        """Закрытие всех соединений"""
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+    
+    def init_database(self):
+        """Инициализация базы данных и применение миграций схемы"""
+        self.migrate()
+    
+    def schema_version(self):
+        """Текущая версия схемы базы"""
+        return self._connection().execute('PRAGMA user_version').fetchone()[0]
+    
+    def migrate(self):
+        """Применение недостающих миграций из MIGRATIONS.
+        
+        Каждая миграция выполняется в отдельной транзакции BEGIN IMMEDIATE,
+        поэтому несколько процессов бота не применят ее дважды, а читатели
+        (WAL) продолжают работать, пока схема меняется.
+        """
+        conn = self._connection()
         
-        conn.commit()
-        conn.close()
+        for version, statements in MIGRATIONS:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                if conn.execute('PRAGMA user_version').fetchone()[0] >= version:
+                    continue
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {version}')
+            logger.info(f"База данных обновлена до версии {version}")
+    
+    def check_query_plans(self):
+        """Проверка, что частые запросы не читают таблицы целиком.
+        
+        Возвращает словарь {имя запроса: строки плана} для запросов, в плане
+        которых есть полный просмотр (SCAN) или сортировка во временном B-дереве.
+        """
+        conn = self._connection()
+        problems = {}
+        
+        for name, (query, params) in HOT_QUERIES.items():
+            plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {query}', params)]
+            if any(detail.startswith('SCAN') or 'TEMP B-TREE' in detail for detail in plan):
+                problems[name] = plan
+        
+        return problems
     
     def add_user(self, user_id, username=None, first_name=None, last_name=None):
         """Добавление нового пользователя"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, username, first_name, last_name))
+        conn = self._connection()
         
-        conn.commit()
-        conn.close()
+        with conn:
+            conn.execute('''
+                INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, username, first_name, last_name))
     
     def add_favorite_recipe(self, user_id, recipe_id, recipe_title, recipe_image, recipe_url):
         """Добавление рецепта в избранное"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
+        conn = self._connection()
         
         try:
-            cursor.execute('''
-                INSERT INTO favorite_recipes (user_id, recipe_id, recipe_title, recipe_image, recipe_url)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user_id, recipe_id, recipe_title, recipe_image, recipe_url))
-            
-            conn.commit()
+            with conn:
+                conn.execute('''
+                    INSERT INTO favorite_recipes (user_id, recipe_id, recipe_title, recipe_image, recipe_url)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (user_id, recipe_id, recipe_title, recipe_image, recipe_url))
             return True
         except sqlite3.IntegrityError:
             # Рецепт уже в избранном
             return False
-        finally:
-            conn.close()
     
     def remove_favorite_recipe(self, user_id, recipe_id):
         """Удаление рецепта из избранного"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
+        conn = self._connection()
         
-        cursor.execute('''
-            DELETE FROM favorite_recipes 
-            WHERE user_id = ? AND recipe_id = ?
-        ''', (user_id, recipe_id))
+        with conn:
+            cursor = conn.execute('''
+                DELETE FROM favorite_recipes 
+                WHERE user_id = ? AND recipe_id = ?
+            ''', (user_id, recipe_id))
         
-        deleted = cursor.rowcount > 0
-        conn.commit()
-        conn.close()
-        return deleted
+        return cursor.rowcount > 0
     
     def get_favorite_recipes(self, user_id):
         """Получение всех избранных рецептов пользователя"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        cursor = self._connection().execute('''
             SELECT recipe_id, recipe_title, recipe_image, recipe_url, rating, added_at
             FROM favorite_recipes 
             WHERE user_id = ?
-            ORDER BY rating DESC, added_at DESC
+            ORDER BY rating DESC, added_at DESC, id DESC
         ''', (user_id,))
         
         recipes = cursor.fetchall()
-        conn.close()
         
         return [
             {
@@ -116,49 +273,391 @@ class Database:
             for recipe in recipes
         ]
     
+    def get_favorite_recipes_page(self, user_id, cursor=None, direction='next', limit=FAVORITES_PAGE_SIZE):
+        """Страница избранного с keyset-пагинацией.
+        
+        cursor - ключ (rating, added_at, id) последней записи предыдущей
+        страницы для direction='next' или первой записи следующей страницы
+        для direction='prev'. Без cursor возвращается первая страница.
+        Каждая страница - один запрос по индексу idx_favorites_user_page.
+        """
+        columns = 'id, recipe_id, recipe_title, recipe_image, recipe_url, rating, added_at'
+        
+        if cursor is None:
+            rows = self._connection().execute(f'''
+                SELECT {columns} FROM favorite_recipes
+                WHERE user_id = ?
+                ORDER BY rating DESC, added_at DESC, id DESC
+                LIMIT ?
+            ''', (user_id, limit + 1)).fetchall()
+        elif direction == 'next':
+            rows = self._connection().execute(f'''
+                SELECT {columns} FROM favorite_recipes
+                WHERE user_id = ? AND (rating, added_at, id) < (?, ?, ?)
+                ORDER BY rating DESC, added_at DESC, id DESC
+                LIMIT ?
+            ''', (user_id, *cursor, limit + 1)).fetchall()
+        else:
+            rows = self._connection().execute(f'''
+                SELECT {columns} FROM favorite_recipes
+                WHERE user_id = ? AND (rating, added_at, id) > (?, ?, ?)
+                ORDER BY rating ASC, added_at ASC, id ASC
+                LIMIT ?
+            ''', (user_id, *cursor, limit + 1)).fetchall()
+        
+        # Лишняя запись показывает, есть ли еще страница в этом направлении
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if cursor is not None and direction == 'prev':
+            rows.reverse()
+        
+        recipes = [
+            {
+                'id': row[0],
+                'recipe_id': row[1],
+                'title': row[2],
+                'image': row[3],
+                'url': row[4],
+                'rating': row[5],
+                'added_at': row[6]
+            }
+            for row in rows
+        ]
+        
+        going_back = cursor is not None and direction == 'prev'
+        return {
+            'recipes': recipes,
+            'has_next': has_more if not going_back else True,
+            'has_prev': cursor is not None and (has_more if going_back else True)
+        }
+    
+    def count_favorite_recipes(self, user_id):
+        """Количество рецептов в избранном пользователя"""
+        cursor = self._connection().execute('''
+            SELECT COUNT(*) FROM favorite_recipes 
+            WHERE user_id = ?
+        ''', (user_id,))
+        
+        return cursor.fetchone()[0]
+    
     def is_favorite_recipe(self, user_id, recipe_id):
         """Проверка, находится ли рецепт в избранном"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        cursor = self._connection().execute('''
             SELECT COUNT(*) FROM favorite_recipes 
             WHERE user_id = ? AND recipe_id = ?
         ''', (user_id, recipe_id))
         
         count = cursor.fetchone()[0]
-        conn.close()
         
         return count > 0
     
+    def get_favorites_status(self, user_id, recipe_ids=None):
+        """Статус избранного для списка рецептов одним запросом.
+        
+        Возвращает словарь {recipe_id: рейтинг} только для рецептов из
+        избранного. Без recipe_ids возвращает все избранное пользователя.
+        """
+        if recipe_ids is None:
+            cursor = self._connection().execute('''
+                SELECT recipe_id, rating FROM favorite_recipes
+                WHERE user_id = ?
+            ''', (user_id,))
+        else:
+            recipe_ids = [int(recipe_id) for recipe_id in recipe_ids]
+            if not recipe_ids:
+                return {}
+            placeholders = ', '.join('?' * len(recipe_ids))
+            cursor = self._connection().execute(f'''
+                SELECT recipe_id, rating FROM favorite_recipes
+                WHERE user_id = ? AND recipe_id IN ({placeholders})
+            ''', (user_id, *recipe_ids))
+        
+        return dict(cursor.fetchall())
+    
     def update_recipe_rating(self, user_id, recipe_id, rating):
         """Обновление рейтинга рецепта"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
+        conn = self._connection()
         
-        cursor.execute('''
-            UPDATE favorite_recipes 
-            SET rating = ?
-            WHERE user_id = ? AND recipe_id = ?
-        ''', (rating, user_id, recipe_id))
+        with conn:
+            cursor = conn.execute('''
+                UPDATE favorite_recipes 
+                SET rating = ?
+                WHERE user_id = ? AND recipe_id = ?
+            ''', (rating, user_id, recipe_id))
+        
+        return cursor.rowcount > 0
+    
+    def apply_pending_writes(self, users, ratings):
+        """Запись накопленных пользователей и рейтингов одной транзакцией.
         
-        updated = cursor.rowcount > 0
-        conn.commit()
-        conn.close()
+        users - кортежи (user_id, username, first_name, last_name),
+        ratings - кортежи (rating, user_id, recipe_id).
+        """
+        conn = self._connection()
         
-        return updated
+        with conn:
+            conn.executemany('''
+                INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
+                VALUES (?, ?, ?, ?)
+            ''', users)
+            conn.executemany('''
+                UPDATE favorite_recipes 
+                SET rating = ?
+                WHERE user_id = ? AND recipe_id = ?
+            ''', ratings)
     
     def get_recipe_rating(self, user_id, recipe_id):
         """Получение рейтинга рецепта"""
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        cursor = self._connection().execute('''
             SELECT rating FROM favorite_recipes 
             WHERE user_id = ? AND recipe_id = ?
         ''', (user_id, recipe_id))
         
         result = cursor.fetchone()
-        conn.close()
         
         return result[0] if result else 0
+    
+    def get_photo_file_id(self, image_url):
+        """file_id фотографии, уже отправленной в Telegram"""
+        result = self._connection().execute(
+            'SELECT file_id FROM photo_file_ids WHERE image_url = ?', (image_url,)
+        ).fetchone()
+        
+        return result[0] if result else None
+    
+    def save_photo_file_id(self, image_url, file_id):
+        """Сохранение file_id фотографии"""
+        conn = self._connection()
+        
+        with conn:
+            conn.execute('''
+                INSERT INTO photo_file_ids (image_url, file_id) VALUES (?, ?)
+                ON CONFLICT (image_url) DO UPDATE
+                SET file_id = excluded.file_id, updated_at = CURRENT_TIMESTAMP
+            ''', (image_url, file_id))
+    
+    def remove_photo_file_id(self, image_url):
+        """Удаление file_id, который Telegram больше не принимает"""
+        conn = self._connection()
+        
+        with conn:
+            conn.execute('DELETE FROM photo_file_ids WHERE image_url = ?', (image_url,))
+
+
+class AsyncDatabase:
+    """Асинхронная обертка над Database.
+    
+    Запросы выполняются в отдельном пуле потоков, чтобы не блокировать
+    event loop. Методы Database доступны под теми же именами как корутины.
+    
+    Регистрация пользователей и рейтинги пишутся отложенно: они копятся в
+    памяти и сбрасываются одной транзакцией раз в WRITE_BEHIND_INTERVAL секунд
+    или при накоплении WRITE_BEHIND_MAX_PENDING записей. Чтения учитывают
+    еще не записанные изменения.
+    """
+    
+    def __init__(self, database=None, workers=DB_EXECUTOR_WORKERS):
+        self.database = database or Database()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db')
+        # Избранное пользователей {recipe_id: рейтинг}, обновляется при каждом изменении
+        self.favorites = LRUCache(FAVORITES_CACHE_USERS)
+        # file_id фотографий рецептов {адрес картинки: file_id}
+        self.photo_file_ids = LRUCache(PHOTO_FILE_ID_CACHE_SIZE)
+        # Отложенные записи: {user_id: данные} и {(user_id, recipe_id): рейтинг}
+        self.pending_users = {}
+        self.pending_ratings = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+        self._size_flush_task = None
+    
+    async def run(self, func, *args, **kwargs):
+        """Выполнение функции в пуле потоков базы"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+    
+    async def get_user_favorites(self, user_id):
+        """Избранное пользователя {recipe_id: рейтинг} из памяти"""
+        favorites = self.favorites.get(user_id)
+        if favorites is None:
+            favorites = await self.run(self.database.get_favorites_status, user_id)
+            # Накладываем рейтинги, которые еще не записаны в базу
+            for (pending_user_id, recipe_id), rating in self.pending_ratings.items():
+                if pending_user_id == user_id and recipe_id in favorites:
+                    favorites[recipe_id] = rating
+            self.favorites.set(user_id, favorites)
+        return favorites
+    
+    async def get_favorites_status(self, user_id, recipe_ids):
+        """Рейтинг для рецептов из избранного и None для остальных"""
+        favorites = await self.get_user_favorites(user_id)
+        return {recipe_id: favorites.get(int(recipe_id)) for recipe_id in recipe_ids}
+    
+    async def is_favorite_recipe(self, user_id, recipe_id):
+        """Проверка, находится ли рецепт в избранном"""
+        return int(recipe_id) in await self.get_user_favorites(user_id)
+    
+    async def count_favorite_recipes(self, user_id):
+        """Количество рецептов в избранном (из памяти или одним COUNT(*))"""
+        favorites = self._cached_favorites(user_id)
+        if favorites is not None:
+            return len(favorites)
+        return await self.run(self.database.count_favorite_recipes, user_id)
+    
+    async def get_recipe_rating(self, user_id, recipe_id):
+        """Получение рейтинга рецепта"""
+        return (await self.get_user_favorites(user_id)).get(int(recipe_id), 0)
+    
+    def _cached_favorites(self, user_id):
+        """Избранное из памяти без загрузки из базы"""
+        entry = self.favorites.get_entry(user_id)
+        return entry[0] if entry is not None else None
+    
+    async def get_photo_file_id(self, image_url):
+        """file_id фотографии из памяти или базы"""
+        file_id = self.photo_file_ids.get(image_url)
+        if file_id is None:
+            file_id = await self.run(self.database.get_photo_file_id, image_url)
+            if file_id is not None:
+                self.photo_file_ids.set(image_url, file_id)
+        return file_id
+    
+    async def save_photo_file_id(self, image_url, file_id):
+        """Сохранение file_id фотографии"""
+        self.photo_file_ids.set(image_url, file_id)
+        await self.run(self.database.save_photo_file_id, image_url, file_id)
+    
+    async def remove_photo_file_id(self, image_url):
+        """Удаление устаревшего file_id"""
+        self.photo_file_ids.pop(image_url)
+        await self.run(self.database.remove_photo_file_id, image_url)
+    
+    async def add_favorite_recipe(self, user_id, recipe_id, *args):
+        """Добавление рецепта в избранное"""
+        added = await self.run(self.database.add_favorite_recipe, user_id, recipe_id, *args)
+        favorites = self._cached_favorites(user_id)
+        if added and favorites is not None:
+            favorites[int(recipe_id)] = 0
+        return added
+    
+    async def remove_favorite_recipe(self, user_id, recipe_id):
+        """Удаление рецепта из избранного"""
+        # Удаление не пересекается со сбросом: иначе снимок с прежней оценкой
+        # мог бы записаться в рецепт, удаленный и снова добавленный за это время
+        async with self._flush_lock:
+            self.pending_ratings.pop((user_id, int(recipe_id)), None)
+            removed = await self.run(self.database.remove_favorite_recipe, user_id, recipe_id)
+        favorites = self._cached_favorites(user_id)
+        if favorites is not None:
+            favorites.pop(int(recipe_id), None)
+        return removed
+    
+    async def update_recipe_rating(self, user_id, recipe_id, rating):
+        """Обновление рейтинга рецепта (отложенная запись)"""
+        favorites = await self.get_user_favorites(user_id)
+        if int(recipe_id) not in favorites:
+            return False
+        
+        favorites[int(recipe_id)] = rating
+        self.pending_ratings[(user_id, int(recipe_id))] = rating
+        self._flush_if_full()
+        return True
+    
+    async def add_user(self, user_id, username=None, first_name=None, last_name=None):
+        """Добавление нового пользователя (отложенная запись)"""
+        self.pending_users[user_id] = (user_id, username, first_name, last_name)
+        self._flush_if_full()
+    
+    async def get_favorite_recipes(self, user_id):
+        """Получение всех избранных рецептов пользователя"""
+        # Список сортируется по рейтингу в базе, поэтому сначала сбрасываем оценки
+        await self.flush()
+        return await self.run(self.database.get_favorite_recipes, user_id)
+    
+    async def get_favorite_recipes_page(self, user_id, cursor=None, direction='next'):
+        """Страница избранного (после сброса отложенных оценок)"""
+        await self.flush()
+        return await self.run(self.database.get_favorite_recipes_page, user_id, cursor, direction)
+    
+    def _flush_if_full(self):
+        """Сброс отложенных записей, если их накопилось много"""
+        if len(self.pending_users) + len(self.pending_ratings) < WRITE_BEHIND_MAX_PENDING:
+            return
+        if self._size_flush_task is not None and not self._size_flush_task.done():
+            return
+        self._size_flush_task = asyncio.get_running_loop().create_task(self.flush())
+        self._size_flush_task.add_done_callback(self._log_flush_error)
+    
+    @staticmethod
+    def _log_flush_error(task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Ошибка записи отложенных изменений", exc_info=task.exception())
+    
+    async def flush(self):
+        """Запись всех отложенных изменений одной транзакцией"""
+        async with self._flush_lock:
+            if not self.pending_users and not self.pending_ratings:
+                return
+            
+            users, self.pending_users = self.pending_users, {}
+            ratings, self.pending_ratings = self.pending_ratings, {}
+            try:
+                await self.run(
+                    self.database.apply_pending_writes,
+                    list(users.values()),
+                    [(rating, user_id, recipe_id) for (user_id, recipe_id), rating in ratings.items()]
+                )
+            except Exception:
+                # Возвращаем записи в очередь, не затирая более новые изменения
+                self.pending_users = {**users, **self.pending_users}
+                self.pending_ratings = {**ratings, **self.pending_ratings}
+                raise
+    
+    def start_write_behind(self, interval=WRITE_BEHIND_INTERVAL):
+        """Запуск периодического сброса отложенных записей"""
+        
+        async def flush_forever():
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await self.flush()
+                except Exception:
+                    # Записи остались в очереди, повторим на следующем шаге
+                    logger.exception("Ошибка записи отложенных изменений")
+        
+        self._flush_task = asyncio.get_running_loop().create_task(flush_forever())
+        return self._flush_task
+    
+    def __getattr__(self, name):
+        method = getattr(self.database, name)
+        if not callable(method):
+            return method
+        
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            return await self.run(method, *args, **kwargs)
+        
+        return call
+    
+    async def close(self):
+        """Сброс отложенных записей, остановка пула потоков и закрытие соединений"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        await self.flush()
+        self.executor.shutdown(wait=True)
+        self.database.close()
+
+
+
+if __name__ == '__main__':
+    import sys
+    
+    # python database.py --check-plans - проверка планов частых запросов
+    database = Database()
+    print(f"Версия схемы: {database.schema_version()}")
+    if '--check-plans' in sys.argv:
+        problems = database.check_query_plans()
+        for name, plan in problems.items():
+            print(f"{name}: {'; '.join(plan)}")
+        if problems:
+            sys.exit(1)
+        print("Все частые запросы используют индексы")
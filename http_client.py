@@ -0,0 +1,120 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+import httpx
+
+from config import (
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_CONNECTIONS_PER_HOST,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT
+)
+
+
+class RateLimiter:
+    """Ограничитель частоты по алгоритму token bucket"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self):
+        """Сколько секунд ждать до появления свободного токена"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        """Забрать токен, если он есть"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def pause(self, seconds):
+        """Не выдавать токены ближайшие seconds секунд (например, после RetryAfter)"""
+        # Следующий токен появится ровно через seconds секунд
+        self._refill()
+        self.tokens = 1 - seconds * self.rate
+
+    async def acquire(self):
+        """Дождаться токена и забрать его"""
+        async with self._lock:
+            while not self.consume():
+                await asyncio.sleep(self.delay())
+
+
+class HTTPClient:
+    """Общий асинхронный HTTP клиент с пулом keep-alive соединений"""
+
+    def __init__(self, per_host_limit=HTTP_MAX_CONNECTIONS_PER_HOST):
+        self.per_host_limit = per_host_limit
+        self._client = None
+        self._host_limits = {}
+
+    @property
+    def client(self):
+        """Ленивое создание httpx-клиента (нужен запущенный event loop)"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+                ),
+                timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+                follow_redirects=True
+            )
+        return self._client
+
+    def _host_limit(self, url):
+        """Семафор, ограничивающий число одновременных запросов к хосту"""
+        host = urlsplit(url).netloc
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.per_host_limit)
+        return self._host_limits[host]
+
+    async def get(self, url, params=None, headers=None, timeout=None):
+        """GET запрос через общий пул соединений"""
+        kwargs = {'params': params, 'headers': headers}
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+
+        async with self._host_limit(url):
+            return await self.client.get(url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, url, params=None, headers=None, timeout=None):
+        """Потоковый GET запрос: тело читается по частям и может быть брошено на середине"""
+        kwargs = {'params': params, 'headers': headers}
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+
+        async with self._host_limit(url):
+            async with self.client.stream('GET', url, **kwargs) as response:
+                yield response
+
+    async def close(self):
+        """Закрытие всех соединений пула"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self._host_limits = {}
+
+
+# Один пул на процесс, общий для всех обработчиков
+http_client = HTTPClient()
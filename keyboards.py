@@ -1,4 +1,6 @@
+import functools
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
+from config import KEYBOARD_CACHE_SIZE
 
 def get_main_menu_keyboard():
     """Главное меню с двумя основными действиями (ReplyKeyboardMarkup)"""
@@ -16,8 +18,19 @@ def get_inline_main_menu_keyboard():
     ]
     return InlineKeyboardMarkup(keyboard)
 
-def get_recipe_actions_keyboard(recipe_id, is_favorite=False, rating=0):
-    """Клавиатура для действий с рецептом"""
+def carousel_data(index, recipe_ids):
+    """Callback data карусели: позиция и id всех рецептов выдачи"""
+    return f"car_{index}_{'-'.join(str(recipe_id) for recipe_id in recipe_ids)}"
+
+@functools.lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def get_recipe_actions_keyboard(recipe_id, is_favorite=False, rating=0, carousel=None):
+    """Клавиатура для действий с рецептом.
+    
+    carousel - (позиция, кортеж id рецептов выдачи) для сообщения-карусели,
+    добавляет строку перелистывания.
+    Результат кэшируется: клавиатуры python-telegram-bot неизменяемы, поэтому
+    одна и та же разметка безопасно переиспользуется для всех сообщений.
+    """
     keyboard = []
     
     if is_favorite:
@@ -43,6 +56,18 @@ def get_recipe_actions_keyboard(recipe_id, is_favorite=False, rating=0):
         InlineKeyboardButton("🎥 Больше видео", callback_data=f"more_videos_{recipe_id}")
     ])
     
+    if carousel:
+        index, recipe_ids = carousel
+        navigation_row = []
+        if index > 0:
+            navigation_row.append(InlineKeyboardButton("⬅️", callback_data=carousel_data(index - 1, recipe_ids)))
+        navigation_row.append(
+            InlineKeyboardButton(f"{index + 1}/{len(recipe_ids)}", callback_data=carousel_data(index, recipe_ids))
+        )
+        if index < len(recipe_ids) - 1:
+            navigation_row.append(InlineKeyboardButton("➡️", callback_data=carousel_data(index + 1, recipe_ids)))
+        keyboard.append(navigation_row)
+    
     keyboard.append([
         InlineKeyboardButton("🔙 Назад к поиску", callback_data="back_to_search")
     ])
@@ -63,15 +88,36 @@ def get_search_options_keyboard():
         [InlineKeyboardButton("🎲 Случайные рецепты", callback_data="random_recipes")],
         [InlineKeyboardButton("🏷️ По категориям", callback_data="search_by_category")],
         [InlineKeyboardButton("🌍 По кухням мира", callback_data="search_by_area")],
+        [InlineKeyboardButton("🥕 По ингредиентам", callback_data="search_by_ingredients")],
         [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main")]
     ]
     return InlineKeyboardMarkup(keyboard)
 
-def get_favorites_menu_keyboard():
+def favorites_cursor_data(direction, page, cursor):
+    """Callback data перехода по страницам избранного.
+    
+    Ключ (rating, added_at, id) кодируется целиком, чтобы следующая страница
+    запрашивалась по индексу без OFFSET.
+    """
+    rating, added_at, favorite_id = cursor
+    timestamp = ''.join(ch for ch in added_at if ch.isdigit())
+    return f"fav_{direction}_{page}_{rating}_{timestamp}_{favorite_id}"
+
+def get_favorites_menu_keyboard(prev_cursor=None, next_cursor=None, page=1):
     """Клавиатура для меню избранного"""
-    keyboard = [
-        [InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main")]
-    ]
+    keyboard = []
+    navigation_row = []
+    if prev_cursor:
+        navigation_row.append(
+            InlineKeyboardButton("⬅️ Назад", callback_data=favorites_cursor_data("prev", page - 1, prev_cursor))
+        )
+    if next_cursor:
+        navigation_row.append(
+            InlineKeyboardButton("Далее ➡️", callback_data=favorites_cursor_data("next", page + 1, next_cursor))
+        )
+    if navigation_row:
+        keyboard.append(navigation_row)
+    keyboard.append([InlineKeyboardButton("🔙 Назад в меню", callback_data="back_to_main")])
     return InlineKeyboardMarkup(keyboard)
 
 def get_rating_keyboard(recipe_id):
@@ -0,0 +1,192 @@
+"""Компактное представление рецепта TheMealDB.
+
+Ответ API - словарь примерно из 50 ключей, большая часть которых - пустые
+strIngredientN/strMeasureN. Recipe хранит только заполненные поля, а
+ингредиенты - кортежем пар (ингредиент, мера). Повторяющиеся строки
+(категории, кухни, ингредиенты, меры) интернируются и существуют в памяти
+в одном экземпляре. Инструкция - самое длинное поле, нужное только при
+отрисовке карточки, - хранится сжатой.
+
+Recipe читается как словарь TheMealDB (recipe['idMeal'],
+recipe.get('strIngredient3')), поэтому код, написанный под ответы API,
+работает с ним без изменений.
+
+Сравнение расхода памяти на рецептах из cache.db:
+    python models.py
+"""
+import json
+import sqlite3
+import sys
+import tracemalloc
+import zlib
+from config import CACHE_DATABASE_NAME
+
+# TheMealDB хранит до 20 ингредиентов в полях strIngredient1..strIngredient20
+MAX_INGREDIENTS = 20
+
+# Поля ответа API -> атрибуты Recipe
+FIELDS = {
+    'idMeal': 'id',
+    'strMeal': 'name',
+    'strCategory': 'category',
+    'strArea': 'area',
+    'strInstructions': 'instructions',
+    'strMealThumb': 'thumb',
+    'strTags': 'tags',
+    'strYoutube': 'youtube',
+    'strSource': 'source'
+}
+
+
+def _intern(value):
+    return sys.intern(value) if value else value
+
+
+def _pack(text):
+    return zlib.compress(text.encode('utf-8')) if text is not None else None
+
+
+class Recipe:
+    """Неизменяемый рецепт TheMealDB с доступом к полям как у словаря API.
+
+    __slots__ объявлены вручную: dataclass(slots=True) требует Python 3.10.
+    """
+
+    __slots__ = (
+        'id', 'name', 'category', 'area', 'packed_instructions', 'thumb',
+        'tags', 'youtube', 'source', 'ingredients'
+    )
+
+    def __init__(self, id, name, category=None, area=None, packed_instructions=None, thumb=None,
+                 tags=None, youtube=None, source=None, ingredients=()):
+        values = (id, name, category, area, packed_instructions, thumb, tags, youtube, source, ingredients)
+        for attr, value in zip(self.__slots__, values):
+            object.__setattr__(self, attr, value)
+
+    def __setattr__(self, attr, value):
+        raise AttributeError(f"Recipe нельзя изменять (поле {attr})")
+
+    def __delattr__(self, attr):
+        raise AttributeError(f"Recipe нельзя изменять (поле {attr})")
+
+    def _values(self):
+        return tuple(getattr(self, attr) for attr in self.__slots__)
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self._values() == other._values()
+
+    def __hash__(self):
+        return hash(self._values())
+
+    def __repr__(self):
+        fields = ', '.join(
+            f"{attr}={getattr(self, attr)!r}"
+            for attr in self.__slots__
+            if attr != 'packed_instructions'
+        )
+        return f"Recipe({fields})"
+
+    def __reduce__(self):
+        return (self.__class__, self._values())
+
+    @classmethod
+    def from_api(cls, data):
+        """Рецепт из ответа API (готовый Recipe возвращается как есть)"""
+        if isinstance(data, cls):
+            return data
+
+        ingredients = []
+        for i in range(1, MAX_INGREDIENTS + 1):
+            ingredient = data.get(f'strIngredient{i}')
+            if ingredient and ingredient.strip():
+                measure = (data.get(f'strMeasure{i}') or '').strip()
+                ingredients.append((_intern(ingredient.strip()), _intern(measure)))
+
+        return cls(
+            id=_intern(str(data['idMeal'])),
+            name=data.get('strMeal'),
+            category=_intern(data.get('strCategory')),
+            area=_intern(data.get('strArea')),
+            packed_instructions=_pack(data.get('strInstructions')),
+            thumb=data.get('strMealThumb'),
+            tags=_intern(data.get('strTags')),
+            youtube=data.get('strYoutube'),
+            source=data.get('strSource'),
+            ingredients=tuple(ingredients)
+        )
+
+    @property
+    def instructions(self):
+        if self.packed_instructions is None:
+            return None
+        return zlib.decompress(self.packed_instructions).decode('utf-8')
+
+    def to_api(self):
+        """Словарь в формате API (для хранения в SQLite)"""
+        data = {key: getattr(self, attr) for key, attr in FIELDS.items()}
+        for i in range(1, MAX_INGREDIENTS + 1):
+            ingredient, measure = self.ingredients[i - 1] if i <= len(self.ingredients) else ('', '')
+            data[f'strIngredient{i}'] = ingredient
+            data[f'strMeasure{i}'] = measure
+        return data
+
+    def _ingredient_field(self, key):
+        """Значение strIngredientN/strMeasureN или None, если ключ другой"""
+        for prefix, position in (('strIngredient', 0), ('strMeasure', 1)):
+            if key.startswith(prefix) and key[len(prefix):].isdigit():
+                index = int(key[len(prefix):]) - 1
+                if 0 <= index < MAX_INGREDIENTS:
+                    return self.ingredients[index][position] if index < len(self.ingredients) else ''
+        return None
+
+    def get(self, key, default=None):
+        attr = FIELDS.get(key)
+        if attr is not None:
+            return getattr(self, attr)
+        value = self._ingredient_field(key)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key, KeyError)
+        if value is KeyError:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return key in FIELDS or self._ingredient_field(key) is not None
+
+
+def measure_memory(recipes):
+    """Память (байт) на хранение рецептов словарями API и объектами Recipe"""
+    payloads = [json.dumps(recipe, ensure_ascii=False) for recipe in recipes]
+
+    def allocated(build):
+        tracemalloc.start()
+        objects = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del objects
+        return size
+
+    # Оба варианта строятся из JSON, как при чтении из кэша
+    dict_size = allocated(lambda: [json.loads(payload) for payload in payloads])
+    model_size = allocated(lambda: [Recipe.from_api(json.loads(payload)) for payload in payloads])
+    return dict_size, model_size
+
+
+if __name__ == '__main__':
+    conn = sqlite3.connect(CACHE_DATABASE_NAME)
+    try:
+        recipes = [json.loads(data) for (data,) in conn.execute('SELECT data FROM recipe_details')]
+    except sqlite3.OperationalError:
+        recipes = []
+    if not recipes:
+        print("В cache.db нет рецептов, сначала запустите sync_catalog.py")
+        sys.exit(1)
+
+    dict_size, model_size = measure_memory(recipes)
+    print(f"Рецептов: {len(recipes)}")
+    print(f"Словари API: {dict_size / len(recipes):.0f} байт на рецепт")
+    print(f"Recipe:      {model_size / len(recipes):.0f} байт на рецепт ({dict_size / model_size:.1f}x меньше)")
@@ -0,0 +1,163 @@
+"""Похожие рецепты на основе ингредиентов, категории и кухни.
+
+Соседи рассчитываются заранее (после синхронизации каталога, периодически
+в фоне бота или командой `python recommendations.py`) и хранятся в таблице recipe_neighbors, поэтому
+кнопка "Найти похожие" выполняет только выборку по ключу.
+"""
+import math
+import sqlite3
+from collections import Counter
+
+import numpy as np
+
+from config import CACHE_DATABASE_NAME, DB_BUSY_TIMEOUT, SIMILAR_RECIPES_TOP_K
+from search_index import extract_ingredients, normalize_ingredient
+
+# Веса групп признаков
+CATEGORY_WEIGHT = 1.5
+AREA_WEIGHT = 1.0
+
+# Сколько строк матрицы сходства считаем за раз
+BLOCK_SIZE = 512
+
+
+def recipe_features(recipe):
+    """Признаки рецепта: ингредиенты, категория и кухня"""
+    features = {
+        'ing:' + ' '.join(sorted(normalize_ingredient(ingredient)))
+        for ingredient in extract_ingredients(recipe)
+    }
+    features.discard('ing:')
+    if recipe.get('strCategory'):
+        features.add('cat:' + recipe['strCategory'])
+    if recipe.get('strArea'):
+        features.add('area:' + recipe['strArea'])
+    return features
+
+
+def build_feature_matrix(recipes):
+    """Нормированная матрица признаков (рецепты x признаки) и id рецептов.
+
+    Ингредиенты взвешиваются по IDF, чтобы соль и масло не делали
+    похожими все рецепты подряд.
+    """
+    recipe_ids = [str(recipe['idMeal']) for recipe in recipes]
+    features = [recipe_features(recipe) for recipe in recipes]
+
+    document_frequency = Counter()
+    for recipe_features_set in features:
+        document_frequency.update(recipe_features_set)
+    vocabulary = {feature: i for i, feature in enumerate(sorted(document_frequency))}
+
+    matrix = np.zeros((len(recipes), len(vocabulary)), dtype=np.float32)
+    total = len(recipes)
+    for row, recipe_features_set in enumerate(features):
+        for feature in recipe_features_set:
+            if feature.startswith('cat:'):
+                weight = CATEGORY_WEIGHT
+            elif feature.startswith('area:'):
+                weight = AREA_WEIGHT
+            else:
+                weight = math.log((1 + total) / (1 + document_frequency[feature])) + 1
+            matrix[row, vocabulary[feature]] = weight
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms, recipe_ids
+
+
+def compute_neighbors(recipes, top_k=SIMILAR_RECIPES_TOP_K):
+    """Top-K соседей каждого рецепта по косинусному сходству"""
+    if len(recipes) < 2:
+        return {}
+
+    matrix, recipe_ids = build_feature_matrix(recipes)
+    k = min(top_k, len(recipe_ids) - 1)
+    neighbors = {}
+
+    for start in range(0, len(recipe_ids), BLOCK_SIZE):
+        block = matrix[start:start + BLOCK_SIZE] @ matrix.T
+        # Сам рецепт себе не сосед
+        rows = np.arange(block.shape[0])
+        block[rows, rows + start] = -1
+
+        top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        for row, candidates in enumerate(top):
+            scores = block[row, candidates]
+            order = np.argsort(-scores)
+            neighbors[recipe_ids[start + row]] = [
+                (recipe_ids[candidates[i]], float(scores[i]))
+                for i in order
+                if scores[i] > 0
+            ]
+
+    return neighbors
+
+
+class SimilarRecipes:
+    """Хранилище предрасчитанных похожих рецептов"""
+
+    def __init__(self, db_name=CACHE_DATABASE_NAME):
+        self.db_name = db_name
+        self.conn = sqlite3.connect(db_name, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS recipe_neighbors (
+                recipe_id TEXT NOT NULL,
+                rank INTEGER NOT NULL,
+                neighbor_id TEXT NOT NULL,
+                score REAL NOT NULL,
+                PRIMARY KEY (recipe_id, rank)
+            ) WITHOUT ROWID
+        ''')
+        self.conn.commit()
+
+    def get(self, recipe_id, limit=SIMILAR_RECIPES_TOP_K):
+        """Id похожих рецептов, самые похожие первыми"""
+        rows = self.conn.execute('''
+            SELECT neighbor_id FROM recipe_neighbors
+            WHERE recipe_id = ?
+            ORDER BY rank
+            LIMIT ?
+        ''', (str(recipe_id), limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def rebuild(self, recipes, top_k=SIMILAR_RECIPES_TOP_K):
+        """Пересчет соседей для всех рецептов.
+
+        Пишет через отдельное соединение, поэтому может выполняться в пуле
+        потоков, пока event loop читает соседей через self.conn.
+        """
+        neighbors = compute_neighbors(list(recipes), top_k)
+        conn = sqlite3.connect(self.db_name)
+        try:
+            conn.execute(f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT}')
+            with conn:
+                conn.execute('DELETE FROM recipe_neighbors')
+                conn.executemany(
+                    'INSERT INTO recipe_neighbors (recipe_id, rank, neighbor_id, score) VALUES (?, ?, ?, ?)',
+                    (
+                        (recipe_id, rank, neighbor_id, score)
+                        for recipe_id, items in neighbors.items()
+                        for rank, (neighbor_id, score) in enumerate(items)
+                    )
+                )
+        finally:
+            conn.close()
+        return len(neighbors)
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(DISTINCT recipe_id) FROM recipe_neighbors').fetchone()[0]
+
+    def close(self):
+        """Закрытие соединения"""
+        self.conn.close()
+
+
+if __name__ == '__main__':
+    from cache import RecipeCache
+
+    cache = RecipeCache()
+    similar = SimilarRecipes()
+    count = similar.rebuild(cache.all_recipes())
+    print(f"Похожие рецепты рассчитаны для {count} рецептов")
@@ -0,0 +1,94 @@
+from cache import LRUCache
+from config import RENDER_CACHE_SIZE
+
+
+class RecipeCard:
+    """Разобранный рецепт TheMealDB, готовый к отображению.
+
+    Разбор исходного словаря (20 пар strIngredientN/strMeasureN, обрезка
+    инструкции) выполняется один раз, подпись карточки без видео собирается
+    при первом обращении и дальше переиспользуется.
+    """
+
+    __slots__ = (
+        'recipe_id', 'title', 'image', 'category', 'area', 'ingredients_text',
+        'instructions', 'youtube_url', 'source_url', '_caption'
+    )
+
+    def __init__(self, recipe):
+        self.recipe_id = recipe.get('idMeal')
+        self.title = recipe.get('strMeal', 'Без названия')
+        self.image = recipe.get('strMealThumb', '')
+        self.category = recipe.get('strCategory', 'Не указано')
+        self.area = recipe.get('strArea', 'Не указано')
+        self.youtube_url = recipe.get('strYoutube', '')
+        self.source_url = recipe.get('strSource', '')
+        self._caption = None
+
+        # Собираем ингредиенты
+        ingredients = []
+        for i in range(1, 21):  # TheMealDB может иметь до 20 ингредиентов
+            ingredient = recipe.get(f'strIngredient{i}')
+            measure = recipe.get(f'strMeasure{i}')
+            if ingredient and ingredient.strip():
+                ingredients.append(f"• {ingredient} - {measure or 'по вкусу'}")
+
+        ingredients_text = "\n".join(ingredients[:10])  # Показываем первые 10 ингредиентов
+        if len(ingredients) > 10:
+            ingredients_text += f"\n... и еще {len(ingredients) - 10} ингредиентов"
+        self.ingredients_text = ingredients_text
+
+        # Ограничиваем длину инструкций
+        instructions = recipe.get('strInstructions', 'Инструкции не найдены')
+        if len(instructions) > 500:
+            instructions = instructions[:500] + "..."
+        self.instructions = instructions
+
+    def caption(self, video_links=''):
+        """HTML подпись карточки; video_links - ссылки на найденные видео"""
+        if self._caption is None:
+            youtube_text = ""
+            if self.youtube_url:
+                youtube_text = f"\n🎥 <a href=\"{self.youtube_url}\">YouTube видеорецепт</a>"
+
+            self._caption = f"""
+🍽️ <b>{self.title}</b>
+
+🏷️ Категория: {self.category}
+🌍 Кухня: {self.area}
+
+📋 <b>Ингредиенты:</b>
+{self.ingredients_text}
+
+📝 <b>Инструкция:</b>
+{self.instructions}
+
+🔗 <a href="{self.source_url}">Подробнее</a>{youtube_text}
+            """.strip()
+        if not video_links:
+            return self._caption
+        return (self._caption + video_links).rstrip()
+
+
+class RecipeRenderer:
+    """Карточки рецептов по id с вытеснением давно не показанных.
+
+    Хранит только RecipeCard, исходные словари после разбора не удерживаются.
+    """
+
+    def __init__(self, size=RENDER_CACHE_SIZE):
+        self.cards = LRUCache(size)
+
+    def card(self, recipe):
+        """Карточка рецепта (разбирается при первом обращении)"""
+        key = recipe.get('idMeal')
+        card = self.cards.get(key)
+        if card is None:
+            card = RecipeCard(recipe)
+            if key is not None:
+                self.cards.set(key, card)
+        return card
+
+    def forget(self, recipe_id):
+        """Сброс карточки после обновления рецепта"""
+        self.cards.pop(recipe_id)
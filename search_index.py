@@ -0,0 +1,220 @@
+import re
+import sqlite3
+import sys
+from collections import Counter, defaultdict
+from cache import TableWriter
+from config import CACHE_DATABASE_NAME, DB_BUSY_TIMEOUT
+from models import Recipe, MAX_INGREDIENTS
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+INGREDIENT_SEPARATORS = re.compile(r'[,;\n]|\s+(?:and|и)\s+', re.IGNORECASE)
+
+
+def extract_ingredients(recipe):
+    """Список непустых ингредиентов рецепта TheMealDB"""
+    if isinstance(recipe, Recipe):
+        return [ingredient for ingredient, _ in recipe.ingredients]
+    ingredients = []
+    for i in range(1, MAX_INGREDIENTS + 1):
+        ingredient = recipe.get(f'strIngredient{i}')
+        if ingredient and ingredient.strip():
+            ingredients.append(ingredient.strip())
+    return ingredients
+
+
+def normalize_word(word):
+    """Приведение слова ингредиента к простой форме: tomatoes -> tomato"""
+    word = word.lower()
+    if len(word) > 4 and word.endswith('oes'):
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def normalize_ingredient(ingredient):
+    """Набор нормализованных слов ингредиента"""
+    return frozenset(normalize_word(word) for word in TOKEN_PATTERN.findall(ingredient))
+
+
+def parse_ingredients_query(text):
+    """Разбор запроса вида "chicken, rice, garlic" в список ингредиентов.
+
+    Без разделителей каждое слово считается отдельным ингредиентом.
+    """
+    parts = [part.strip() for part in INGREDIENT_SEPARATORS.split(text) if part.strip()]
+    if len(parts) == 1:
+        parts = TOKEN_PATTERN.findall(parts[0])
+    return parts
+
+
+class IngredientIndex:
+    """Обратный индекс: слово ингредиента -> id рецептов"""
+
+    def __init__(self):
+        self.postings = defaultdict(set)
+        self.recipe_words = {}
+        self.ingredient_counts = {}
+
+    def add(self, recipe):
+        """Добавление или обновление рецепта в индексе"""
+        recipe_id = str(recipe['idMeal'])
+        self.remove(recipe_id)
+
+        ingredients = extract_ingredients(recipe)
+        # Слова интернируются: в постингах и recipe_words одна копия строки
+        words = set()
+        for ingredient in ingredients:
+            words.update(sys.intern(word) for word in normalize_ingredient(ingredient))
+        for word in words:
+            self.postings[word].add(recipe_id)
+        self.recipe_words[recipe_id] = frozenset(words)
+        self.ingredient_counts[recipe_id] = len(ingredients)
+
+    def remove(self, recipe_id):
+        """Удаление рецепта из индекса"""
+        for word in self.recipe_words.pop(recipe_id, ()):
+            self.postings[word].discard(recipe_id)
+            if not self.postings[word]:
+                del self.postings[word]
+        self.ingredient_counts.pop(recipe_id, None)
+
+    def rebuild(self, recipes):
+        """Полная перестройка индекса"""
+        self.postings.clear()
+        self.recipe_words.clear()
+        self.ingredient_counts.clear()
+        for recipe in recipes:
+            self.add(recipe)
+
+    def match(self, ingredient):
+        """Рецепты, содержащие ингредиент (все его слова)"""
+        words = normalize_ingredient(ingredient)
+        if not words:
+            return set()
+        sets = sorted((self.postings.get(word, set()) for word in words), key=len)
+        return set.intersection(*sets)
+
+    def search(self, ingredients, limit=5):
+        """Поиск рецептов по списку ингредиентов.
+
+        Рецепты ранжируются по числу найденных ингредиентов запроса, затем по
+        доле ингредиентов рецепта, которые есть у пользователя.
+        """
+        matches = [self.match(ingredient) for ingredient in ingredients]
+        matches = [recipe_ids for recipe_ids in matches if recipe_ids]
+        if not matches:
+            return []
+
+        coverage = Counter()
+        for recipe_ids in matches:
+            coverage.update(recipe_ids)
+
+        def rank(recipe_id):
+            return (
+                -coverage[recipe_id],
+                -coverage[recipe_id] / max(self.ingredient_counts.get(recipe_id, 1), 1),
+                recipe_id
+            )
+
+        # Рецепты со всеми ингредиентами - это пересечение, они окажутся первыми
+        return sorted(coverage, key=rank)[:limit]
+
+    def __len__(self):
+        return len(self.recipe_words)
+
+
+def index_row(recipe):
+    """Поля рецепта для записи в recipe_fts"""
+    return (
+        str(recipe['idMeal']),
+        recipe.get('strMeal') or '',
+        ' '.join(extract_ingredients(recipe)),
+        recipe.get('strCategory') or '',
+        recipe.get('strArea') or ''
+    )
+
+
+class RecipeIndex:
+    """Локальный полнотекстовый индекс рецептов на SQLite FTS5.
+
+    Новые рецепты попадают в индекс пакетной записью вне event loop, поэтому
+    становятся доступны поиску с задержкой до CACHE_WRITE_INTERVAL.
+    """
+
+    def __init__(self, db_name=CACHE_DATABASE_NAME):
+        self.conn = sqlite3.connect(db_name, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT}')
+        self.conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS recipe_fts USING fts5(
+                recipe_id UNINDEXED,
+                name,
+                ingredients,
+                category,
+                area,
+                tokenize = 'unicode61 remove_diacritics 2',
+                prefix = '2 3'
+            )
+        ''')
+        self.conn.commit()
+
+        self.writer = TableWriter(
+            db_name,
+            [
+                'DELETE FROM recipe_fts WHERE recipe_id = ?',
+                'INSERT INTO recipe_fts (recipe_id, name, ingredients, category, area) VALUES (?, ?, ?, ?, ?)'
+            ],
+            lambda key, recipe: ((key,), index_row(recipe))
+        )
+
+    def add(self, recipe):
+        """Добавление или обновление рецепта в индексе (пакетной записью)"""
+        self.writer.add(str(recipe['idMeal']), recipe)
+
+    def rebuild(self, recipes):
+        """Полная перестройка индекса по набору рецептов"""
+        self.writer.flush()
+        self.conn.execute('DELETE FROM recipe_fts')
+        self.conn.executemany(
+            'INSERT INTO recipe_fts (recipe_id, name, ingredients, category, area) VALUES (?, ?, ?, ?, ?)',
+            (index_row(recipe) for recipe in recipes)
+        )
+        self.conn.commit()
+
+    def __len__(self):
+        self.writer.flush()
+        return self.conn.execute('SELECT COUNT(*) FROM recipe_fts').fetchone()[0]
+
+    def search(self, query, limit=5, require_all=False):
+        """Поиск id рецептов по запросу, лучшие совпадения первыми.
+
+        Сначала ищем рецепты, содержащие все слова запроса (по префиксу),
+        если таких нет - хотя бы одно из них. require_all=True отключает
+        поиск по отдельным словам.
+        """
+        tokens = TOKEN_PATTERN.findall(query.lower())
+        if not tokens:
+            return []
+
+        terms = [f'"{token}"*' for token in tokens]
+        matches = [' AND '.join(terms)] if require_all else [' AND '.join(terms), ' OR '.join(terms)]
+        for match in matches:
+            # Название весит больше всего, затем ингредиенты
+            rows = self.conn.execute('''
+                SELECT recipe_id FROM recipe_fts
+                WHERE recipe_fts MATCH ?
+                ORDER BY bm25(recipe_fts, 0.0, 10.0, 4.0, 2.0, 2.0)
+                LIMIT ?
+            ''', (match, limit)).fetchall()
+            if rows:
+                return [row[0] for row in rows]
+            if len(terms) == 1:
+                break
+        return []
+
+    def close(self):
+        """Запись накопленных рецептов и закрытие соединений с индексом"""
+        self.writer.close()
+        self.conn.close()
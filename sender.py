@@ -0,0 +1,130 @@
+import asyncio
+import heapq
+import itertools
+import logging
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from cache import LRUCache
+from http_client import RateLimiter
+from config import (
+    SEND_GLOBAL_RATE,
+    SEND_CHAT_RATE,
+    SEND_CHAT_BURST,
+    SEND_GROUP_RATE,
+    SEND_GROUP_BURST,
+    SEND_CHAT_BUCKETS,
+    SEND_MAX_RETRIES
+)
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты запросов (меньше - раньше)
+INTERACTIVE_PRIORITY = 0  # Ответы на действия пользователя
+BULK_PRIORITY = 1  # Карточки выдачи и их дополнение видео
+
+
+class PriorityBucket:
+    """Token bucket, который раздает токены ожидающим в порядке приоритета.
+
+    Пока токены есть и очереди нет, запрос проходит без ожидания. Иначе он
+    становится в очередь, и токены выдаются по (приоритет, порядок прихода).
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.limiter = RateLimiter(rate, capacity)
+        self._waiters = []
+        self._counter = itertools.count()
+        self._task = None
+
+    async def acquire(self, priority=INTERACTIVE_PRIORITY):
+        """Дождаться токена с учетом приоритета"""
+        if not self._waiters and self.limiter.consume():
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._dispatch())
+        await future
+
+    async def _dispatch(self):
+        while self._waiters:
+            future = self._waiters[0][2]
+            if future.done():
+                # Ожидавший запрос отменили
+                heapq.heappop(self._waiters)
+            elif self.limiter.consume():
+                heapq.heappop(self._waiters)
+                future.set_result(None)
+            else:
+                await asyncio.sleep(self.limiter.delay())
+
+    def pause(self, seconds):
+        """Не выдавать токены ближайшие seconds секунд (после RetryAfter)"""
+        self.limiter.pause(seconds)
+
+    def close(self):
+        """Остановка раздачи токенов"""
+        if self._task is not None:
+            self._task.cancel()
+
+
+class MessageScheduler(BaseRateLimiter):
+    """Планировщик исходящих запросов к Telegram.
+
+    Каждый запрос к чату проходит через token bucket этого чата (личные чаты
+    и группы с разными лимитами) и через общий bucket бота. Ответы на действия
+    пользователя обгоняют массовые отправки: приоритет передается через
+    rate_limit_args (INTERACTIVE_PRIORITY или BULK_PRIORITY). При RetryAfter
+    приостанавливается только чат, получивший ограничение, а запрос
+    повторяется до SEND_MAX_RETRIES раз.
+    """
+
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, max_retries=SEND_MAX_RETRIES):
+        self.global_bucket = PriorityBucket(global_rate)
+        self.chat_buckets = LRUCache(SEND_CHAT_BUCKETS)
+        self.max_retries = max_retries
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        self.global_bucket.close()
+        for _, bucket in self.chat_buckets.items():
+            bucket.close()
+        self.chat_buckets.clear()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            # Отрицательные id и @username - группы и каналы
+            if isinstance(chat_id, str) or chat_id < 0:
+                bucket = PriorityBucket(SEND_GROUP_RATE, SEND_GROUP_BURST)
+            else:
+                bucket = PriorityBucket(SEND_CHAT_RATE, SEND_CHAT_BURST)
+            self.chat_buckets.set(chat_id, bucket)
+        return bucket
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        if isinstance(chat_id, str) and chat_id.lstrip('-').isdigit():
+            chat_id = int(chat_id)
+        priority = rate_limit_args if isinstance(rate_limit_args, int) else INTERACTIVE_PRIORITY
+
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None:
+                bucket = self._chat_bucket(chat_id)
+                await bucket.acquire(priority)
+                await self.global_bucket.acquire(priority)
+
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"{endpoint}: ограничение Telegram для чата {chat_id}, повтор через {e.retry_after} с")
+                if chat_id is not None:
+                    bucket.pause(e.retry_after)
+                else:
+                    await asyncio.sleep(e.retry_after)
@@ -0,0 +1,43 @@
+import asyncio
+
+
+class SingleFlight:
+    """Объединение одновременных одинаковых запросов.
+
+    Пока запрос с данным ключом выполняется, повторные вызовы не запускают
+    новый, а ждут результат уже идущего. Все ожидающие получают один и тот же
+    объект результата (или исключение), поэтому изменять его нельзя.
+    Отмена одного из ожидающих не прерывает запрос для остальных.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key, func, *args, **kwargs):
+        """Выполнение func(*args, **kwargs) не более одного раза на ключ одновременно"""
+        task = self._calls.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Исключение уже получили ожидающие; если их не осталось, не шумим в логах
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        """Сколько запросов выполнено и сколько вызовов присоединились к идущим"""
+        return {
+            'calls': self.calls,
+            'shared': self.shared,
+            'in_flight': len(self._calls)
+        }
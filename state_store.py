@@ -0,0 +1,264 @@
+import json
+import sqlite3
+import time
+from telegram.ext import BasePersistence, PersistenceInput
+from cache import LRUCache, TableWriter
+from config import (
+    STATE_BACKEND,
+    STATE_DATABASE_NAME,
+    STATE_TTL,
+    STATE_MEMORY_SIZE,
+    STATE_MAX_ROWS
+)
+
+
+class MemoryStateStore:
+    """Состояния в памяти процесса: LRU с ограничением размера и TTL.
+
+    Подходит для одного процесса; после перезапуска состояния теряются.
+    """
+
+    def __init__(self, maxsize=STATE_MEMORY_SIZE, ttl=STATE_TTL):
+        self.ttl = ttl
+        self.memory = LRUCache(maxsize, ttl)
+
+    def get(self, key, default=None):
+        """Состояние по ключу (истекшие считаются отсутствующими)"""
+        return self.memory.get(key, default)
+
+    def set(self, key, value):
+        """Сохранение состояния"""
+        self.memory.set(key, value)
+
+    def pop(self, key, default=None):
+        """Удаление состояния"""
+        return self.memory.pop(key, default)
+
+    def items(self):
+        """Все неистекшие состояния"""
+        return self.memory.items()
+
+    def cleanup(self):
+        """Удаление истекших состояний"""
+        self.memory.expire()
+
+    def close(self):
+        """Освобождение памяти"""
+        self.memory.clear()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self.memory)
+
+
+class SQLiteStateStore:
+    """Состояния в таблице SQLite, общей для всех процессов бота.
+
+    Каждая запись - JSON-значение в пространстве имен namespace. Записи не
+    коммитятся в event loop: они копятся в TableWriter и пишутся пакетом из
+    пула потоков, а чтения сначала смотрят в еще не записанные изменения.
+    Другие процессы видят изменение с задержкой до CACHE_WRITE_INTERVAL,
+    чего достаточно, так как обновления пользователя обрабатывает один
+    процесс. Истекшие записи и записи сверх max_rows удаляются периодически.
+    """
+
+    def __init__(self, namespace='user_state', db_name=STATE_DATABASE_NAME,
+                 ttl=STATE_TTL, max_rows=STATE_MAX_ROWS):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._sets_since_cleanup = 0
+
+        self.conn = sqlite3.connect(db_name, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA busy_timeout=5000')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS states (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+        ''')
+        self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_states_updated_at
+            ON states (namespace, updated_at)
+        ''')
+        self.conn.commit()
+
+        # Удаление записывается как запись с updated_at = 0: она сразу считается
+        # истекшей и убирается при очистке
+        self.writer = TableWriter(
+            db_name,
+            '''
+                INSERT INTO states (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (namespace, key) DO UPDATE
+                SET value = excluded.value, updated_at = excluded.updated_at
+            ''',
+            lambda key, entry: (self.namespace, key, json.dumps(entry[0], ensure_ascii=False), entry[1]),
+            on_flush=self._cleanup_after_flush
+        )
+
+    def get(self, key, default=None):
+        """Состояние по ключу (истекшие считаются отсутствующими)"""
+        min_updated_at = time.time() - self.ttl
+        entry = self.writer.get(json.dumps(key))
+        if entry is not None:
+            return entry[0] if entry[1] >= min_updated_at else default
+
+        row = self.conn.execute(
+            'SELECT value FROM states WHERE namespace = ? AND key = ? AND updated_at >= ?',
+            (self.namespace, json.dumps(key), min_updated_at)
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key, value):
+        """Сохранение состояния (запись в базу - пакетом вне event loop)"""
+        self.writer.add(json.dumps(key), (value, time.time()))
+
+    def pop(self, key, default=None):
+        """Удаление состояния"""
+        value = self.get(key, default)
+        self.writer.add(json.dumps(key), (None, 0))
+        return value
+
+    def items(self):
+        """Все неистекшие состояния"""
+        self.writer.flush()
+        rows = self.conn.execute(
+            'SELECT key, value FROM states WHERE namespace = ? AND updated_at >= ?',
+            (self.namespace, time.time() - self.ttl)
+        ).fetchall()
+        return [(json.loads(key), json.loads(value)) for key, value in rows]
+
+    def _cleanup_after_flush(self, conn, count):
+        # Чистим таблицу не на каждой записи
+        self._sets_since_cleanup += count
+        if self._sets_since_cleanup >= 100:
+            self._sets_since_cleanup = 0
+            self.cleanup(conn)
+
+    def cleanup(self, conn=None):
+        """Удаление истекших состояний и самых старых сверх max_rows"""
+        conn = conn or self.conn
+        conn.execute(
+            'DELETE FROM states WHERE namespace = ? AND updated_at < ?',
+            (self.namespace, time.time() - self.ttl)
+        )
+        conn.execute('''
+            DELETE FROM states WHERE namespace = ? AND key IN (
+                SELECT key FROM states WHERE namespace = ?
+                ORDER BY updated_at DESC
+                LIMIT -1 OFFSET ?
+            )
+        ''', (self.namespace, self.namespace, self.max_rows))
+        conn.commit()
+
+    def close(self):
+        """Запись накопленных изменений и закрытие соединений с базой состояний"""
+        self.writer.close()
+        self.conn.close()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        self.writer.flush()
+        return self.conn.execute(
+            'SELECT COUNT(*) FROM states WHERE namespace = ?', (self.namespace,)
+        ).fetchone()[0]
+
+
+def create_state_store(namespace='user_state', backend=STATE_BACKEND):
+    """Хранилище состояний по настройке STATE_BACKEND ('memory' или 'sqlite')"""
+    if backend == 'memory':
+        return MemoryStateStore()
+    if backend == 'sqlite':
+        return SQLiteStateStore(namespace)
+    raise ValueError(f"Неизвестный STATE_BACKEND: {backend}")
+
+
+class StateStorePersistence(BasePersistence):
+    """Persistence для python-telegram-bot поверх хранилищ состояний.
+
+    user_data, chat_data, bot_data и состояния ConversationHandler хранятся
+    в отдельных пространствах имен того же бэкенда, поэтому на них действуют
+    те же TTL и ограничение размера. callback_data не сохраняется.
+    """
+
+    def __init__(self, backend=STATE_BACKEND, update_interval=60):
+        super().__init__(
+            store_data=PersistenceInput(callback_data=False),
+            update_interval=update_interval
+        )
+        self.user_data = create_state_store('user_data', backend)
+        self.chat_data = create_state_store('chat_data', backend)
+        self.bot_data = create_state_store('bot_data', backend)
+        self.conversations = create_state_store('conversations', backend)
+
+    async def get_user_data(self):
+        return {int(key): value for key, value in self.user_data.items()}
+
+    async def get_chat_data(self):
+        return {int(key): value for key, value in self.chat_data.items()}
+
+    async def get_bot_data(self):
+        return self.bot_data.get('bot', {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        # Ключи ConversationHandler - кортежи, в JSON они превращаются в списки
+        return {tuple(key): state for key, state in self.conversations.get(name, [])}
+
+    async def update_user_data(self, user_id, data):
+        self.user_data.set(user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        self.chat_data.set(chat_id, data)
+
+    async def update_bot_data(self, data):
+        self.bot_data.set('bot', data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        conversation = dict(await self.get_conversations(name))
+        if new_state is None:
+            conversation.pop(key, None)
+        else:
+            conversation[key] = new_state
+        self.conversations.set(name, [[list(k), state] for k, state in conversation.items()])
+
+    async def drop_user_data(self, user_id):
+        self.user_data.pop(user_id)
+
+    async def drop_chat_data(self, chat_id):
+        self.chat_data.pop(chat_id)
+
+    async def refresh_user_data(self, user_id, user_data):
+        # Данные могли измениться в другом процессе
+        stored = self.user_data.get(user_id)
+        if stored is not None:
+            user_data.clear()
+            user_data.update(stored)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        stored = self.chat_data.get(chat_id)
+        if stored is not None:
+            chat_data.clear()
+            chat_data.update(stored)
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        for store in (self.user_data, self.chat_data, self.bot_data, self.conversations):
+            store.cleanup()
+            store.close()
@@ -0,0 +1,153 @@
+"""Зеркалирование каталога TheMealDB в локальный кэш.
+
+Запуск:
+    python sync_catalog.py          # инкрементальная синхронизация
+    python sync_catalog.py --full   # перезагрузить все рецепты
+
+Сначала обновляются списки категорий и кухонь, затем через filter.php
+собираются id всех рецептов, и для новых или изменившихся выполняется
+lookup.php. Прерванная синхронизация продолжается с места остановки.
+После загрузки пересчитываются похожие рецепты.
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+from api_client import AsyncRecipeAPI
+from config import SYNC_REQUESTS_PER_SECOND, SYNC_CONCURRENCY
+from http_client import RateLimiter
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+class CatalogSync:
+    """Синхронизация каталога TheMealDB с ограничением частоты запросов"""
+
+    def __init__(self, api, rate=SYNC_REQUESTS_PER_SECOND, concurrency=SYNC_CONCURRENCY):
+        self.api = api
+        self.limiter = RateLimiter(rate)
+        self.concurrency = concurrency
+        self.conn = api.cache.conn
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS sync_state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+        self.conn.commit()
+
+    def _get_state(self, key):
+        row = self.conn.execute('SELECT value FROM sync_state WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_state(self, key, value):
+        if value is None:
+            self.conn.execute('DELETE FROM sync_state WHERE key = ?', (key,))
+        else:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)',
+                (key, str(value))
+            )
+        self.conn.commit()
+
+    async def collect_catalog(self):
+        """Краткие записи всех рецептов из списков по категориям и кухням"""
+        # Запросы filter.php идут через тот же ограничитель частоты, что и lookup.php
+        await self.api.refresh_listings(self.limiter)
+
+        catalog = {}
+        for key in self.api.listings.keys():
+            if key in ('categories', 'areas'):
+                continue
+            for recipe in self.api.listings.get(key) or []:
+                catalog[recipe['idMeal']] = recipe
+        return catalog
+
+    def needs_update(self, summary, full_sync_started_at):
+        """Нужно ли загружать рецепт заново"""
+        stored, fetched_at = self.api.cache.get_stored(summary['idMeal'])
+        if stored is None:
+            return True
+        if full_sync_started_at is not None:
+            # При полной синхронизации пропускаем только то, что уже загрузили в этом прогоне
+            return fetched_at < full_sync_started_at
+        return (
+            stored.get('strMeal') != summary.get('strMeal')
+            or stored.get('strMealThumb') != summary.get('strMealThumb')
+        )
+
+    async def run(self, full=False):
+        """Синхронизация каталога, возвращает число загруженных рецептов"""
+        started_at = self._get_state('full_sync_started_at')
+        if full and started_at is None:
+            started_at = time.time()
+            self._set_state('full_sync_started_at', started_at)
+        elif started_at is not None:
+            logger.info("Продолжаю прерванную полную синхронизацию")
+        started_at = float(started_at) if started_at is not None else None
+
+        catalog = await self.collect_catalog()
+        pending = []
+        unchanged = []
+        for recipe_id, summary in catalog.items():
+            if self.needs_update(summary, started_at):
+                pending.append(recipe_id)
+            elif started_at is None:
+                unchanged.append(recipe_id)
+        logger.info(f"Рецептов в каталоге: {len(catalog)}, к загрузке: {len(pending)}")
+
+        # Неизменившиеся рецепты остаются в зеркале: без продления срока
+        # кэш перестал бы их отдавать через RECIPE_CACHE_TTL + RECIPE_CACHE_STALE_TTL
+        self.api.cache.touch(unchanged)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        done = 0
+        failed = 0
+
+        async def fetch(recipe_id):
+            nonlocal done, failed
+            async with semaphore:
+                await self.limiter.acquire()
+                result = await self.api.fetch_recipe_details(recipe_id)
+            if "error" in result:
+                failed += 1
+                logger.warning(f"Рецепт {recipe_id} не загружен: {result['error']}")
+                return
+            done += 1
+            if done % 50 == 0:
+                logger.info(f"Загружено {done} из {len(pending)}")
+
+        await asyncio.gather(*(fetch(recipe_id) for recipe_id in pending))
+
+        if not failed:
+            self._set_state('full_sync_started_at', None)
+        self._set_state('last_sync_at', time.time())
+        logger.info(f"Синхронизация завершена: загружено {done}, ошибок {failed}")
+
+        if done or not len(self.api.similar):
+            count = self.api.rebuild_similar_recipes()
+            logger.info(f"Похожие рецепты рассчитаны для {count} рецептов")
+        return done
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Синхронизация каталога TheMealDB")
+    parser.add_argument('--full', action='store_true', help="загрузить заново все рецепты")
+    parser.add_argument('--rate', type=float, default=SYNC_REQUESTS_PER_SECOND, help="запросов в секунду")
+    parser.add_argument('--concurrency', type=int, default=SYNC_CONCURRENCY, help="одновременных запросов")
+    args = parser.parse_args()
+
+    api = AsyncRecipeAPI()
+    try:
+        await CatalogSync(api, args.rate, args.concurrency).run(full=args.full)
+    finally:
+        await api.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
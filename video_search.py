@@ -1,6 +1,146 @@
+import asyncio
+import html
+import httpx
 import requests
 import re
-from config import VK_API_TOKEN, MAX_VIDEO_RESULTS
+from html.parser import HTMLParser
+from config import VK_API_TOKEN, MAX_VIDEO_RESULTS, VIDEO_SEARCH_DEADLINE
+from cache import VideoCache, normalize_query
+from http_client import http_client
+from singleflight import SingleFlight
+
+RUTUBE_VIDEO_HREF = re.compile(r'^(?:https?://rutube\.ru)?/video/([a-zA-Z0-9_-]+)/?')
+DURATION_PATTERN = re.compile(r'^(?:(\d{1,2}):)?(\d{1,2}):(\d{2})$')
+# Элементы без закрывающего тега
+VOID_ELEMENTS = frozenset((
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'source', 'track', 'wbr'
+))
+
+
+def parse_duration(text):
+    """Длительность вида 1:02:03 или 12:34 в секундах"""
+    match = DURATION_PATTERN.match(text.strip())
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def format_duration(seconds):
+    """Секунды в вид 12:34 или 1:02:03"""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+class RutubeSearchParser(HTMLParser):
+    """Инкрементальный разбор страницы поиска Rutube.
+    
+    Страница подается кусками через feed(), а как только найдено limit
+    видео с названиями, complete становится True и загрузку можно прервать.
+    Текст элемента может прийти несколькими кусками (граница чанка, сущности),
+    поэтому он копится до закрывающего тега и только тогда разбирается.
+    """
+    
+    def __init__(self, limit=MAX_VIDEO_RESULTS):
+        super().__init__()
+        self.limit = limit
+        self.videos = {}
+        self.current_id = None
+        # Открытые внутри карточки элементы: [тег, куски текста]
+        self.elements = []
+        self.skip_depth = 0
+        self.extra_seen = False
+    
+    @property
+    def complete(self):
+        if self.extra_seen:
+            return True
+        if len(self.videos) < self.limit:
+            return False
+        return all(video['title'] for video in self.videos.values())
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in ('script', 'style'):
+            self.skip_depth += 1
+            return
+        if tag == 'a':
+            self.start_video_link(dict(attrs))
+        if self.current_id is not None and tag not in VOID_ELEMENTS:
+            self.elements.append([tag, []])
+    
+    def start_video_link(self, attrs):
+        match = RUTUBE_VIDEO_HREF.match(attrs.get('href') or '')
+        if not match:
+            return
+        
+        video_id = match.group(1)
+        if video_id not in self.videos:
+            if len(self.videos) >= self.limit:
+                # Началась следующая карточка - предыдущие уже разобраны
+                self.extra_seen = True
+                return
+            self.videos[video_id] = {'id': video_id, 'title': '', 'duration': 0}
+        
+        self.current_id = video_id
+        # Текст предыдущей карточки к новой ссылке не относится
+        self.elements = []
+        title = attrs.get('title') or attrs.get('aria-label')
+        if title and not self.videos[video_id]['title']:
+            self.videos[video_id]['title'] = title.strip()
+    
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style'):
+            self.skip_depth = max(self.skip_depth - 1, 0)
+            return
+        
+        # Незакрытые вложенные элементы закрываются вместе с родителем
+        for position in range(len(self.elements) - 1, -1, -1):
+            if self.elements[position][0] == tag:
+                break
+        else:
+            return
+        while len(self.elements) > position:
+            self.end_element(*self.elements.pop())
+    
+    def end_element(self, tag, pieces):
+        text = ''.join(pieces)
+        video = self.videos.get(self.current_id)
+        duration = parse_duration(text)
+        if duration is not None:
+            # Длительность выводится на превью внутри карточки
+            if video is not None and not video['duration']:
+                video['duration'] = duration
+            return
+        
+        if tag == 'a':
+            title = ' '.join(text.split())
+            if video is not None and not video['title'] and title:
+                video['title'] = title
+        elif self.elements:
+            # Текст дочерних элементов отделяется от текста родителя пробелом
+            self.elements[-1][1].append(f' {text} ')
+    
+    def handle_data(self, data):
+        if self.skip_depth or not self.elements:
+            return
+        self.elements[-1][1].append(data)
+    
+    def results(self, query):
+        """Найденные видео в формате VideoSearch"""
+        return [
+            {
+                'title': video['title'] or f"Рецепт {query} на Rutube",
+                'url': f"https://rutube.ru/video/{video['id']}/",
+                'platform': 'Rutube',
+                'duration': video['duration']
+            }
+            for video in self.videos.values()
+        ]
+
 
 class VideoSearch:
     def __init__(self):
@@ -29,21 +169,7 @@ class VideoSearch:
             
             response = requests.get(url, params=params)
             response.raise_for_status()
-            data = response.json()
-            
-            if 'response' in data and 'items' in data['response']:
-                videos = []
-                for item in data['response']['items']:
-                    video_info = {
-                        'title': item.get('title', ''),
-                        'url': f"https://vk.com/video{item['owner_id']}_{item['id']}",
-                        'platform': 'VK',
-                        'duration': item.get('duration', 0)
-                    }
-                    videos.append(video_info)
-                return videos
-            else:
-                return []
+            return self._parse_vk_response(response.json())
                 
         except requests.RequestException as e:
             print(f"Ошибка VK API: {e}")
@@ -62,24 +188,32 @@ class VideoSearch:
             response = requests.get(search_url, headers=headers, timeout=10)
             response.raise_for_status()
             
-            # Ищем ссылки на видео в HTML с более точным паттерном
-            video_links = re.findall(r'href="(/video/[a-zA-Z0-9_-]+)"', response.text)
+            return self._parse_rutube_links(response.text, query)
             
+        except requests.RequestException as e:
+            print(f"Ошибка Rutube поиска: {e}")
+            return []
+    
+    def _parse_rutube_links(self, page, query):
+        """Извлечение видео из страницы поиска Rutube"""
+        parser = RutubeSearchParser()
+        parser.feed(page)
+        return parser.results(query)
+    
+    def _parse_vk_response(self, data):
+        """Разбор ответа VK API video.search"""
+        if 'response' in data and 'items' in data['response']:
             videos = []
-            for link in video_links[:MAX_VIDEO_RESULTS]:
-                video_url = f"https://rutube.ru{link}"
+            for item in data['response']['items']:
                 video_info = {
-                    'title': f"Рецепт {query} на Rutube",
-                    'url': video_url,
-                    'platform': 'Rutube',
-                    'duration': 0
+                    'title': item.get('title', ''),
+                    'url': f"https://vk.com/video{item['owner_id']}_{item['id']}",
+                    'platform': 'VK',
+                    'duration': item.get('duration', 0)
                 }
                 videos.append(video_info)
-            
             return videos
-            
-        except requests.RequestException as e:
-            print(f"Ошибка Rutube поиска: {e}")
+        else:
             return []
     
     def search_all_videos(self, recipe_name):
@@ -110,6 +244,111 @@ class VideoSearch:
                 'YouTube': '🔴'
             }.get(video['platform'], '📹')
             
-            video_text += f"{i}. {platform_icon} <a href=\"{video['url']}\">{video['platform']} - {video['title']}</a>\n"
+            duration = f" ({format_duration(video['duration'])})" if video.get('duration') else ""
+            video_text += f"{i}. {platform_icon} <a href=\"{video['url']}\">{video['platform']} - {html.escape(video['title'])}</a>{duration}\n"
         
         return video_text
+
+
+class AsyncVideoSearch(VideoSearch):
+    """Асинхронный поиск видео: сервисы опрашиваются параллельно с общим дедлайном"""
+    
+    def __init__(self, client=None, deadline=VIDEO_SEARCH_DEADLINE, cache=None):
+        super().__init__()
+        self.http = client or http_client
+        self.deadline = deadline
+        self.cache = cache or VideoCache()
+        self.flights = SingleFlight()
+    
+    async def _search_cached(self, platform, query, fetch):
+        """Поиск через кэш: повторные запросы того же блюда не уходят в сеть"""
+        videos = self.cache.get(platform, query)
+        if videos is not None:
+            return videos
+        
+        try:
+            videos = await fetch(query)
+        except httpx.HTTPError as e:
+            # Ошибки не кэшируем, чтобы повторить запрос в следующий раз
+            print(f"Ошибка поиска видео {platform}: {e}")
+            return []
+        
+        self.cache.put(platform, query, videos)
+        return videos
+    
+    async def search_vk_videos(self, query):
+        """Поиск видео на VK"""
+        if not self.vk_token:
+            return []
+        return await self._search_cached('VK', query, self._fetch_vk_videos)
+    
+    async def search_rutube_videos(self, query):
+        """Поиск видео на Rutube через веб-скрапинг"""
+        return await self._search_cached('Rutube', query, self._fetch_rutube_videos)
+    
+    async def _fetch_vk_videos(self, query):
+        """Запрос к VK API video.search"""
+        params = {
+            'access_token': self.vk_token,
+            'q': f"{query} рецепт",
+            'count': MAX_VIDEO_RESULTS,
+            'v': '5.131'
+        }
+        
+        response = await self.http.get("https://api.vk.com/method/video.search", params=params)
+        response.raise_for_status()
+        return self._parse_vk_response(response.json())
+    
+    async def _fetch_rutube_videos(self, query):
+        """Потоковый разбор страницы поиска Rutube.
+        
+        Загрузка прерывается, как только найдено MAX_VIDEO_RESULTS видео.
+        """
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+        }
+        parser = RutubeSearchParser()
+        
+        async with self.http.stream(
+            "https://rutube.ru/search/",
+            params={'text': f"{query} рецепт"},
+            headers=headers,
+            timeout=10
+        ) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_text():
+                parser.feed(chunk)
+                if parser.complete:
+                    break
+        
+        return parser.results(query)
+    
+    async def search_all_videos(self, recipe_name):
+        """Параллельный поиск видео на всех платформах.
+        
+        Через deadline секунд возвращаются результаты тех сервисов,
+        которые успели ответить. Одновременные поиски одного блюда
+        выполняются один раз.
+        """
+        return await self.flights.do(normalize_query(recipe_name), self._search_all_videos, recipe_name)
+    
+    async def _search_all_videos(self, recipe_name):
+        tasks = [
+            asyncio.create_task(self.search_vk_videos(recipe_name)),
+            asyncio.create_task(self.search_rutube_videos(recipe_name))
+        ]
+        done, pending = await asyncio.wait(tasks, timeout=self.deadline)
+        for task in pending:
+            task.cancel()
+        
+        # Сохраняем порядок сервисов: сначала VK, затем Rutube
+        all_videos = []
+        for task in tasks:
+            if task in done and task.exception() is None:
+                all_videos.extend(task.result())
+        
+        return all_videos
+    
+    def close(self):
+        """Закрытие кэша видео"""
+        self.cache.close()
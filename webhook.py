@@ -0,0 +1,330 @@
+"""Запуск бота в режиме webhook с несколькими рабочими процессами.
+
+Запуск:
+    WEBHOOK_URL=https://example.com/telegram WEBHOOK_SECRET=secret python webhook.py
+
+Главный процесс принимает обновления от Telegram по HTTP и раскладывает их
+по очередям рабочих процессов. Обновления одного пользователя всегда
+попадают в один и тот же процесс (user_id % WEBHOOK_WORKERS), поэтому
+порядок их обработки сохраняется, а кэши избранного и состояния
+пользователя в памяти процесса остаются согласованными. Общие данные
+(recipes.db, cache.db, state.db) лежат в SQLite в режиме WAL и безопасно
+используются всеми процессами одновременно.
+
+Общие фоновые задачи (обновление списков, расчет похожих рецептов)
+выполняет только рабочий процесс 0. Упавший рабочий процесс
+перезапускается; если он падает чаще WEBHOOK_RESTART_LIMIT раз за
+WEBHOOK_RESTART_WINDOW секунд, webhook останавливается с ошибкой.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import signal
+import sys
+import time
+from collections import deque
+
+from telegram import Bot, Update
+from config import (
+    TELEGRAM_TOKEN,
+    WEBHOOK_URL,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_WORKERS,
+    WEBHOOK_RESTART_LIMIT,
+    WEBHOOK_RESTART_WINDOW,
+    SEND_GLOBAL_RATE
+)
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(processName)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 1024 * 1024
+
+
+def _object_id(value):
+    """Целочисленный id объекта Telegram (пользователя или чата) или None"""
+    if isinstance(value, dict) and isinstance(value.get('id'), int):
+        return value['id']
+    return None
+
+
+def routing_key(update):
+    """Ключ распределения обновления: id пользователя, иначе id чата"""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        sender = _object_id(value.get('from')) or _object_id(value.get('user'))
+        if sender is not None:
+            return sender
+        message = value.get('message')
+        chat = _object_id(value.get('chat')) or (_object_id(message.get('chat')) if isinstance(message, dict) else None)
+        if chat is not None:
+            return chat
+    update_id = update.get('update_id')
+    return update_id if isinstance(update_id, int) else 0
+
+
+def run_worker(index, queue, taken):
+    """Рабочий процесс: отдельное приложение бота без собственного Updater.
+
+    taken - счетчик в общей памяти, сколько обновлений процесс забрал из очереди.
+    """
+    # bot импортируется только в рабочем процессе: при импорте он открывает
+    # соединения с базами, которые нельзя передавать между процессами
+    import bot
+
+    async def process_updates():
+        # Общий лимит отправки Telegram делится между процессами поровну
+        application = bot.build_application(
+            updater=False,
+            send_rate=SEND_GLOBAL_RATE / WEBHOOK_WORKERS,
+            shared_jobs=index == 0
+        )
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        logger.info(f"Рабочий процесс {index} запущен")
+
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                data = await loop.run_in_executor(None, queue.get)
+                if data is None:
+                    break
+                taken.value += 1
+                try:
+                    await application.update_queue.put(Update.de_json(data, application.bot))
+                except Exception:
+                    # Одно некорректное обновление не должно останавливать процесс
+                    logger.exception(f"Обновление {data.get('update_id')} пропущено")
+        finally:
+            await application.stop()
+            await application.shutdown()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+            logger.info(f"Рабочий процесс {index} остановлен")
+
+    # Остановкой рабочих процессов управляет главный процесс через очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(process_updates())
+
+
+class WebhookServer:
+    """HTTP прием обновлений Telegram и раздача их рабочим процессам"""
+
+    def __init__(self, workers=WEBHOOK_WORKERS, listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT,
+                 path=WEBHOOK_PATH, secret=WEBHOOK_SECRET):
+        self.workers = workers
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret = secret
+        # spawn: рабочие процессы не наследуют соединения и потоки главного
+        self.context = multiprocessing.get_context('spawn')
+        self.queues = []
+        self.processes = []
+        # Обновления, отправленные в очередь процесса, но еще не забранные им:
+        # при падении процесса их передаем заново, читать его очередь нельзя
+        self.unread = [deque() for _ in range(workers)]
+        self.taken = []
+        self.confirmed = [0] * workers
+        self.restarts = [deque() for _ in range(workers)]
+        self.failed = False
+
+    def _spawn(self, index, queue, taken):
+        process = self.context.Process(target=run_worker, args=(index, queue, taken), name=f"bot-worker-{index}")
+        process.start()
+        return process
+
+    def start_workers(self):
+        """Запуск рабочих процессов"""
+        for index in range(self.workers):
+            queue = self.context.Queue()
+            taken = self.context.Value('q', 0, lock=False)
+            self.queues.append(queue)
+            self.taken.append(taken)
+            self.processes.append(self._spawn(index, queue, taken))
+
+    def _forget_taken(self, index):
+        """Удаление из unread обновлений, которые процесс уже забрал"""
+        unread = self.unread[index]
+        taken = self.taken[index].value
+        while self.confirmed[index] < taken and unread:
+            unread.popleft()
+            self.confirmed[index] += 1
+
+    def restart_worker(self, index):
+        """Перезапуск упавшего рабочего процесса с новой очередью.
+
+        Упавший процесс мог умереть посреди чтения и оставить очередь
+        заблокированной, поэтому старая очередь бросается, а еще не забранные
+        им обновления отправляются в новую из unread. Обновления, которые
+        процесс уже забрал, но не успел обработать, теряются.
+        """
+        self._forget_taken(index)
+        old_queue, queue = self.queues[index], self.context.Queue()
+        old_queue.cancel_join_thread()
+        old_queue.close()
+
+        taken = self.context.Value('q', 0, lock=False)
+        for update in self.unread[index]:
+            queue.put(update)
+        self.queues[index], self.taken[index], self.confirmed[index] = queue, taken, 0
+        self.processes[index] = self._spawn(index, queue, taken)
+        logger.warning(
+            f"Рабочий процесс {index} перезапущен, передано заново обновлений: {len(self.unread[index])}; "
+            "обновления, которые он уже забрал из очереди, могли быть потеряны"
+        )
+
+    async def supervise(self, stop, interval=1):
+        """Перезапуск упавших рабочих процессов до остановки webhook"""
+        while not stop.is_set():
+            for index, process in enumerate(self.processes):
+                if process.is_alive():
+                    continue
+                logger.error(f"Рабочий процесс {index} завершился с кодом {process.exitcode}")
+
+                now = time.monotonic()
+                history = self.restarts[index]
+                history.append(now)
+                while now - history[0] > WEBHOOK_RESTART_WINDOW:
+                    history.popleft()
+                if len(history) > WEBHOOK_RESTART_LIMIT:
+                    logger.critical(
+                        f"Рабочий процесс {index} падает {len(history)} раз за {WEBHOOK_RESTART_WINDOW} с, "
+                        "останавливаю webhook"
+                    )
+                    self.failed = True
+                    stop.set()
+                    return
+                self.restart_worker(index)
+
+            try:
+                await asyncio.wait_for(stop.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def stop_workers(self):
+        """Остановка рабочих процессов после обработки уже принятых обновлений"""
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            process.join()
+
+    def dispatch(self, update):
+        """Передача обновления в процесс, закрепленный за пользователем"""
+        index = routing_key(update) % self.workers
+        self._forget_taken(index)
+        self.unread[index].append(update)
+        self.queues[index].put(update)
+
+    async def handle_connection(self, reader, writer):
+        """Обработка HTTP/1.1 соединения (с поддержкой keep-alive)"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY_SIZE:
+                    await self.respond(writer, 413, 'Payload Too Large')
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                if target.split('?', 1)[0] != self.path:
+                    status = (404, 'Not Found')
+                elif method != 'POST':
+                    status = (405, 'Method Not Allowed')
+                elif headers.get('x-telegram-bot-api-secret-token') != self.secret:
+                    status = (403, 'Forbidden')
+                else:
+                    try:
+                        update = json.loads(body)
+                    except ValueError:
+                        update = None
+                    # Обновление Telegram - всегда JSON-объект
+                    if isinstance(update, dict):
+                        self.dispatch(update)
+                        status = (200, 'OK')
+                    else:
+                        status = (400, 'Bad Request')
+
+                await self.respond(writer, *status)
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception:
+            logger.exception("Ошибка обработки запроса webhook")
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def respond(writer, status, reason):
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Length: 0\r\n\r\n".encode('latin-1'))
+        await writer.drain()
+
+    async def serve(self):
+        """Регистрация webhook в Telegram и прием обновлений до остановки"""
+        self.start_workers()
+
+        bot = Bot(TELEGRAM_TOKEN)
+        async with bot:
+            await bot.set_webhook(
+                WEBHOOK_URL,
+                secret_token=self.secret,
+                allowed_updates=Update.ALL_TYPES
+            )
+
+        server = await asyncio.start_server(self.handle_connection, self.listen, self.port)
+        logger.info(f"Webhook слушает {self.listen}:{self.port}{self.path}, рабочих процессов: {self.workers}")
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        async with server:
+            await self.supervise(stop)
+            await stop.wait()
+
+        logger.info("Остановка webhook")
+        await loop.run_in_executor(None, self.stop_workers)
+
+
+def main():
+    """Запуск бота в режиме webhook"""
+    if not TELEGRAM_TOKEN or not WEBHOOK_URL:
+        logger.error("TELEGRAM_TOKEN или WEBHOOK_URL не настроены!")
+        return
+    if not WEBHOOK_SECRET:
+        # Без секрета любой, кто знает адрес, может присылать поддельные обновления
+        logger.error("WEBHOOK_SECRET не настроен!")
+        return
+    server = WebhookServer()
+    asyncio.run(server.serve())
+    if server.failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()